@@ -141,7 +141,10 @@ func Ls() {
 	switch flg.NArg() {
 	case 1:
 		prefix := flg.Arg(0)
-		val := strings.SplitN(prefix, "://", 2)[1]
+		if !strings.HasPrefix(prefix, "s4://") {
+			usage()
+		}
+		val := strings.TrimPrefix(prefix, "s4://")
 		if !*recursive && strings.Count(val, "/") == 0 {
 			for _, line := range panic2(s4.ListBuckets(servers)).([][]string) {
 				if lib.Contains(line, val) {
@@ -199,13 +202,13 @@ func Health() {
 	}
 	servers := panic2(lib.GetServers(*confPath)).([]lib.Server)
 	results := make(chan string, len(servers))
-	client := http.Client{Timeout: 1 * time.Second}
+	client := http.Client{Timeout: 1 * time.Second, Transport: lib.Transport}
 	for _, server := range servers {
 		go func(server lib.Server) {
 			url := fmt.Sprintf("http://%s:%s/health", server.Address, server.Port)
 			resp, err := client.Get(url)
-			if err != nil {
-				panic1(resp.Body.Close())
+			if err == nil {
+				_ = resp.Body.Close()
 			}
 			if err != nil || resp.StatusCode != 200 {
 				results <- fmt.Sprintf("unhealthy: %s:%s", server.Address, server.Port)
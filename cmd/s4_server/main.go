@@ -1,23 +1,28 @@
 package main
 
 import (
+	"bytes"
+	"crypto/rand"
+	"encoding/hex"
 	"encoding/json"
 	"errors"
 	"flag"
 	"fmt"
+	"io"
 	"io/ioutil"
 	"net/http"
 	"os"
 	"path"
 	"path/filepath"
 	"runtime"
+	"strconv"
 	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	"github.com/nathants/s4"
 	"github.com/nathants/s4/lib"
-	uuid "github.com/satori/go.uuid"
 	"golang.org/x/sync/semaphore"
 )
 
@@ -27,61 +32,76 @@ var (
 	ioRecvPool *semaphore.Weighted
 	cpuPool    *semaphore.Weighted
 	miscPool   *semaphore.Weighted
-	soloPool   *semaphore.Weighted
+	soloLock   sync.Mutex
+	jobPrefix  = newJobPrefix()
+	jobCounter uint64
+	verifyDisk bool
 )
 
+func newJobPrefix() string {
+	b := make([]byte, 4)
+	panic2(rand.Read(b))
+	return hex.EncodeToString(b)
+}
+
+func newJobID() (uint64, string) {
+	id := atomic.AddUint64(&jobCounter, 1)
+	return id, fmt.Sprintf("%s-%d", jobPrefix, id)
+}
+
+func parseJobID(uid string) uint64 {
+	assert(strings.HasPrefix(uid, jobPrefix+"-"), "no such job: %s", uid)
+	return panic2(strconv.ParseUint(uid[len(jobPrefix)+1:], 10, 64)).(uint64)
+}
+
+type transferResult struct {
+	checksum string
+	err      error
+}
+
 type GetJob struct {
-	start          time.Time
-	serverChecksum chan string
-	fail           chan error
-	diskChecksum   string
+	start        time.Time
+	result       chan transferResult
+	diskChecksum string
 }
 
 func prepareGetHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
 	port := lib.QueryParam(r, "port")
 	key := lib.QueryParam(r, "key")
 	assert(panic2(lib.OnThisServer(key, this, servers)).(bool), "wrong server for request\n")
-	remote := strings.SplitN(r.RemoteAddr, ":", 2)[0]
+	remote := lib.RemoteHost(r)
 	if remote == "127.0.0.1" {
 		remote = "0.0.0.0"
 	}
-	path := strings.SplitN(key, "s4://", 2)[1]
-	var exists bool
-	lib.With(soloPool, func() {
-		exists = panic2(lib.Exists(path)).(bool)
-	})
+	path := strings.TrimPrefix(key, "s4://")
+	exists := panic2(lib.Exists(path)).(bool)
 	if !exists {
 		w.WriteHeader(404)
 		return
 	}
-	uid := uuid.NewV4().String()
-	started := make(chan bool, 1)
-	fail := make(chan error, 1)
-	serverChecksum := make(chan string, 1)
+	id, uid := newJobID()
+	started := make(chan struct{})
+	result := make(chan transferResult, 1)
 	go lib.With(ioSendPool, func() {
-		started <- true
+		close(started)
 		chk, err := lib.SendFile(path, remote, port)
 		if err != nil {
 			lib.Logger.Println("send error:", err)
 		}
-		fail <- err
-		serverChecksum <- chk
-	})
-	var diskChecksum string
-	lib.With(soloPool, func() {
-		diskChecksum = panic2(lib.ChecksumRead(path)).(string)
+		result <- transferResult{chk, err}
 	})
+	diskChecksum := cachedChecksumRead(path)
 	job := &GetJob{
 		time.Now(),
-		serverChecksum,
-		fail,
+		result,
 		diskChecksum,
 	}
-	_, loaded := ioJobs.LoadOrStore(uid, job)
-	assert(!loaded, uid)
+	ioJobs.Store(id, job)
+	timer := time.NewTimer(lib.Timeout)
+	defer timer.Stop()
 	select {
-	case <-time.After(lib.Timeout):
-		ioJobs.Delete(uid)
+	case <-timer.C:
+		ioJobs.Delete(id)
 		w.WriteHeader(429)
 	case <-started:
 		panic2(w.Write([]byte(uid)))
@@ -91,91 +111,100 @@ func prepareGetHandler(w http.ResponseWriter, r *http.Request, this lib.Server,
 func confirmGetHandler(w http.ResponseWriter, r *http.Request) {
 	uid := lib.QueryParam(r, "uuid")
 	clientChecksum := lib.QueryParam(r, "checksum")
-	v, ok := ioJobs.LoadAndDelete(uid)
+	v, ok := ioJobs.LoadAndDelete(parseJobID(uid))
 	assert(ok, uid)
 	job := v.(*GetJob)
-	panic1(<-job.fail)
-	serverChecksum := <-job.serverChecksum
+	result := <-job.result
+	panic1(result.err)
+	serverChecksum := result.checksum
 	diskChecksum := job.diskChecksum
 	assert(clientChecksum == serverChecksum && serverChecksum == diskChecksum, "checksum mismatch: %s %s %s\n", clientChecksum, serverChecksum, diskChecksum)
 	w.WriteHeader(200)
 }
 
 type PutJob struct {
-	start          time.Time
-	serverChecksum chan string
-	fail           chan error
-	path           string
-	tempPath       string
+	start    time.Time
+	result   chan transferResult
+	path     string
+	tempPath string
 }
 
 func preparePutHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
 	key := lib.QueryParam(r, "key")
 	assert(!strings.Contains(key, " "), "key contains spaces: %s\n", key)
 	assert(panic2(lib.OnThisServer(key, this, servers)).(bool), "wrong server for request")
-	path := strings.SplitN(key, "s4://", 2)[1]
+	path := strings.TrimPrefix(key, "s4://")
 	assert(!strings.HasPrefix(path, "_"), path)
-	var exists bool
-	var tempPath string
-	lib.With(soloPool, func() {
-		exists = panic2(lib.Exists(path)).(bool)
-		tempPath = lib.NewTempPath("_tempfiles")
-	})
+	exists := panic2(lib.Exists(path)).(bool)
 	if exists {
 		w.WriteHeader(409)
 		return
 	}
-	uid := uuid.NewV4().String()
+	tempPath := lib.NewTempPath("_tempfiles")
+	trackTemp(tempPath)
+	id, uid := newJobID()
 	port := make(chan string, 1)
-	fail := make(chan error, 1)
-	serverChecksum := make(chan string, 1)
+	result := make(chan transferResult, 1)
+	job := &PutJob{time.Now(), result, path, tempPath}
+	ioJobs.Store(id, job)
 	go lib.With(ioRecvPool, func() {
-		chk, err := lib.RecvFile(tempPath, port)
+		if _, ok := ioJobs.Load(id); !ok {
+			_ = os.Remove(tempPath)
+			untrackTemp(tempPath)
+			result <- transferResult{"", fmt.Errorf("job expired before recv: %s", uid)}
+			return
+		}
+		chk, err := lib.RecvFileReadOnly(tempPath, port)
 		if err != nil {
 			lib.Logger.Println("recv error:", err)
+			untrackTemp(tempPath)
 		}
-		fail <- err
-		serverChecksum <- chk
+		result <- transferResult{chk, err}
 	})
-	job := &PutJob{time.Now(), serverChecksum, fail, path, tempPath}
-	_, loaded := ioJobs.LoadOrStore(uid, job)
-	assert(!loaded, uid)
+	timer := time.NewTimer(lib.Timeout)
+	defer timer.Stop()
 	select {
-	case <-time.After(lib.Timeout):
-		ioJobs.Delete(uid)
-		_ = os.Remove(path)
-		_ = os.Remove(panic2(lib.ChecksumPath(path)).(string))
+	case <-timer.C:
+		ioJobs.Delete(id)
+		_ = os.Remove(tempPath)
+		untrackTemp(tempPath)
 		w.WriteHeader(429)
 	case p := <-port:
 		w.Header().Set("Content-Type", "application/text")
-		panic2(fmt.Fprintf(w, "%s %s", uid, p))
+		panic2(io.WriteString(w, uid+" "+p))
 	}
 }
 
 func confirmPutHandler(w http.ResponseWriter, r *http.Request) {
 	uid := lib.QueryParam(r, "uuid")
 	clientChecksum := lib.QueryParam(r, "checksum")
-	v, ok := ioJobs.LoadAndDelete(uid)
+	v, ok := ioJobs.LoadAndDelete(parseJobID(uid))
 	assert(ok, "no such job: %s", uid)
 	job := v.(*PutJob)
-	panic1(<-job.fail)
-	serverChecksum := <-job.serverChecksum
+	result := <-job.result
+	panic1(result.err)
+	serverChecksum := result.checksum
 	assert(clientChecksum == serverChecksum, "checksum mismatch: %s %s\n", clientChecksum, serverChecksum)
 	exists := false
-	lib.With(soloPool, func() {
-		panic1(os.MkdirAll(lib.Dir(job.path), os.ModePerm))
+	withSolo(func() {
+		panic1(mkdirSolo(lib.Dir(job.path)))
 		exists = panic2(lib.Exists(job.path)).(bool)
 		if !exists {
 			panic1(ioutil.WriteFile(panic2(lib.ChecksumPath(job.path)).(string), []byte(serverChecksum), 0o444))
-			panic1(os.Chmod(job.tempPath, 0o444))
 			panic1(os.Rename(job.tempPath, job.path))
+			untrackTemp(job.tempPath)
+			checksumCache.Set(job.path, serverChecksum)
+			forgetBucketList(job.path)
 		}
 	})
 	if exists {
 		w.WriteHeader(409)
-	} else {
-		w.WriteHeader(200)
+		return
 	}
+	if verifyDisk {
+		panic1(verifyOnDisk(job.path, serverChecksum))
+	}
+	w.WriteHeader(200)
 }
 
 func deleteHandler(r *http.Request, this lib.Server, servers []lib.Server) {
@@ -184,12 +213,20 @@ func deleteHandler(r *http.Request, this lib.Server, servers []lib.Server) {
 	if !recursive {
 		assert(panic2(lib.OnThisServer(prefix, this, servers)).(bool), "wrong server for request")
 	}
-	prefix = strings.SplitN(prefix, "s4://", 2)[1]
+	assert(strings.HasPrefix(prefix, "s4://"), "missing s4:// prefix: %s", prefix)
+	prefix = strings.TrimPrefix(prefix, "s4://")
 	assert(!strings.HasPrefix(prefix, "/"), prefix)
 	cwd := path.Base(panic2(os.Getwd()).(string))
 	assert(cwd == "s4_data", cwd)
-	lib.With(soloPool, func() {
+	withSolo(func() {
+		defer forgetBucketList(prefix)
 		if recursive {
+			checksumCache.Clear()
+			soloDirs.Clear()
+		}
+		if recursive && strings.HasSuffix(prefix, "/") {
+			panic1(os.RemoveAll(prefix))
+		} else if recursive {
 			files, dirs := listRecursive(prefix, false)
 			for _, info := range *files {
 				assert(!strings.HasPrefix(info.Path, "/"), info.Path)
@@ -202,28 +239,40 @@ func deleteHandler(r *http.Request, this lib.Server, servers []lib.Server) {
 			}
 		} else {
 			assert(!strings.HasPrefix(prefix, "/"), prefix)
+			checksumCache.Delete(prefix)
 			panic1(os.Remove(prefix))
 			panic1(os.Remove(panic2(lib.ChecksumPath(prefix)).(string)))
 		}
 	})
 }
 
+var checksumCache = lib.NewCache(1<<18, 0)
+
+func cachedChecksumRead(path string) string {
+	val, gen, ok := checksumCache.Get(path)
+	if ok {
+		return val.(string)
+	}
+	checksum := panic2(lib.ChecksumRead(path)).(string)
+	checksumCache.Fill(gen, path, checksum)
+	return checksum
+}
+
 type MapResult struct {
-	WarnResult *lib.WarnResultTempdir
-	Outkey     string
+	Tempdir string
+	Err     error
 }
 
 func mapHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
-	var data lib.MapArgs
-	bytes := panic2(ioutil.ReadAll(r.Body)).([]byte)
-	panic1(json.Unmarshal(bytes, &data))
+	data := lib.ParseMapArgs(r)
 	indir, glob := lib.ParseGlob(data.Indir)
 	outdir := data.Outdir
+	assert(strings.HasPrefix(indir, "s4://"), fmt.Sprintf("indir must start with s4://, got: %s", indir))
 	assert(strings.HasSuffix(indir, "/"), fmt.Sprintf("indir not a directory: %s", indir))
 	assert(strings.HasSuffix(outdir, "/"), fmt.Sprintf("outdir not a directory: %s", outdir))
-	pth := strings.SplitN(indir, "://", 2)[1]
+	pth := strings.TrimPrefix(indir, "s4://")
 	files, _ := listRecursive(pth, true)
-	pth = strings.SplitN(pth, "/", 2)[1]
+	pth = pth[strings.Index(pth, "/")+1:]
 	if strings.HasPrefix(data.Cmd, "while read") {
 		data.Cmd = fmt.Sprintf("cat | %s", data.Cmd)
 	}
@@ -247,47 +296,48 @@ func mapHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers
 		}
 		inkey := lib.Join(indir, key)
 		outkey := lib.Join(outdir, key)
-		inpath := panic2(filepath.Abs(strings.SplitN(inkey, "s4://", 2)[1])).(string)
+		inpath := panic2(filepath.Abs(strings.TrimPrefix(inkey, "s4://"))).(string)
 		go func(inpath string) {
+			var result *lib.WarnResultTempdir
+			var checksum string
 			lib.With(cpuPool, func() {
-				result := lib.WarnTempdir(fmt.Sprintf("export filename=%s; < %s %s > output", path.Base(inpath), inpath, data.Cmd))
-				results <- MapResult{result, outkey}
+				f, err := os.Open(inpath)
+				if err != nil {
+					result = &lib.WarnResultTempdir{Stderr: err.Error(), Err: err}
+					return
+				}
+				defer func() { _ = f.Close() }()
+				result, checksum = lib.WarnTempdirOutput(f, "export filename=%s; %s", path.Base(inpath), data.Cmd)
+				trackTemp(result.Tempdir)
 			})
+			results <- mapPut(result, checksum, outkey, this, servers)
 		}(inpath)
 		count++
 	}
+	awaitMapResults(w, results, count)
+}
+
+func mapPut(result *lib.WarnResultTempdir, checksum string, outkey string, this lib.Server, servers []lib.Server) MapResult {
+	if result.Err != nil {
+		return MapResult{result.Tempdir, fmt.Errorf(result.Stdout + "\n" + result.Stderr)}
+	}
+	tempPath := lib.Join(result.Tempdir, "output")
+	return MapResult{result.Tempdir, localPutChecksum(tempPath, outkey, checksum, this, servers)}
+}
+
+func awaitMapResults(w http.ResponseWriter, results <-chan MapResult, count int) {
 	var tempdirs []string
 	defer cleanup(&tempdirs)
 	timeout := time.After(lib.MaxTimeout)
-	jobs := make(chan error, len(*files))
-	fail := make(chan error, 1)
-	go func() {
-		for i := 0; i < count; i++ {
-			result := <-results
-			tempdirs = append(tempdirs, result.WarnResult.Tempdir)
-			if result.WarnResult.Err != nil {
-				fail <- fmt.Errorf(result.WarnResult.Stdout + "\n" + result.WarnResult.Stderr)
-				break
-			} else {
-				go func(result MapResult) {
-					tempPath := lib.Join(result.WarnResult.Tempdir, "output")
-					err := localPut(tempPath, result.Outkey, this, servers)
-					if err != nil {
-						fail <- err
-					} else {
-						jobs <- nil
-					}
-				}(result)
-			}
-		}
-	}()
 	for i := 0; i < count; i++ {
 		select {
-		case <-jobs:
-		case err := <-fail:
-			w.WriteHeader(500)
-			panic2(fmt.Fprintf(w, "%s", err))
-			return
+		case result := <-results:
+			tempdirs = append(tempdirs, result.Tempdir)
+			if result.Err != nil {
+				w.WriteHeader(500)
+				panic2(fmt.Fprintf(w, "%s", result.Err))
+				return
+			}
 		case <-timeout:
 			w.WriteHeader(429)
 			return
@@ -297,6 +347,18 @@ func mapHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers
 }
 
 func localPut(tempPath string, key string, this lib.Server, servers []lib.Server) error {
+	var checksum string
+	var err error
+	lib.With(miscPool, func() {
+		checksum, err = lib.ChecksumReadOnly(tempPath)
+	})
+	if err != nil {
+		return err
+	}
+	return localPutChecksum(tempPath, key, checksum, this, servers)
+}
+
+func localPutChecksum(tempPath string, key string, checksum string, this lib.Server, servers []lib.Server) error {
 	if strings.Contains(key, " ") {
 		return fmt.Errorf("key contains space: %s", key)
 	}
@@ -307,25 +369,52 @@ func localPut(tempPath string, key string, this lib.Server, servers []lib.Server
 	if !onThisServer {
 		return fmt.Errorf("wrong server for key: %s", key)
 	}
-	path := strings.SplitN(key, "s4://", 2)[1]
+	path := strings.TrimPrefix(key, "s4://")
 	if strings.HasPrefix(path, "_") {
 		return fmt.Errorf("path cannot start with underscore: %s", path)
 	}
-	var checksum string
-	lib.With(miscPool, func() {
-		checksum, err = lib.Checksum(tempPath)
+	withSolo(func() {
+		err = confirmLocalPut(tempPath, path, checksum)
+		if err == nil {
+			checksumCache.Set(path, checksum)
+			forgetBucketList(path)
+		}
 	})
-	if err != nil {
+	if err != nil || !verifyDisk {
 		return err
 	}
-	lib.With(soloPool, func() {
-		err = confirmLocalPut(tempPath, path, checksum)
+	return verifyOnDisk(path, checksum)
+}
+
+func verifyOnDisk(path string, checksum string) error {
+	var diskChecksum string
+	var err error
+	lib.With(miscPool, func() {
+		diskChecksum, err = lib.ChecksumDisk(path)
+	})
+	if err == nil && diskChecksum == checksum {
+		return nil
+	}
+	if err == nil {
+		err = fmt.Errorf("checksum mismatch on disk: %s %s %s", path, checksum, diskChecksum)
+	}
+	var rmErr error
+	withSolo(func() {
+		defer forgetBucketList(path)
+		checksumCache.Delete(path)
+		rmErr = os.Remove(path)
+		if rmErr == nil {
+			rmErr = os.Remove(path + ".xxh")
+		}
 	})
+	if rmErr != nil {
+		return fmt.Errorf("%s, cleanup failed: %s", err, rmErr)
+	}
 	return err
 }
 
 func confirmLocalPut(tempPath string, path string, checksum string) error {
-	err := os.MkdirAll(lib.Dir(path), os.ModePerm)
+	err := mkdirSolo(lib.Dir(path))
 	if err != nil {
 		return err
 	}
@@ -336,10 +425,6 @@ func confirmLocalPut(tempPath string, path string, checksum string) error {
 	if exists {
 		return fmt.Errorf("fatal: key already exists s4://%s", path)
 	}
-	err = os.Chmod(tempPath, 0o444)
-	if err != nil {
-		return err
-	}
 	err = os.Rename(tempPath, path)
 	if err != nil {
 		return err
@@ -356,21 +441,21 @@ type MapToNResult struct {
 func cleanup(tempdirs *[]string) {
 	for _, tempdir := range *tempdirs {
 		panic1(os.RemoveAll(tempdir))
+		untrackTemp(tempdir)
 	}
 }
 
 func mapToNHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
-	var data lib.MapArgs
-	bytes := panic2(ioutil.ReadAll(r.Body)).([]byte)
-	panic1(json.Unmarshal(bytes, &data))
+	data := lib.ParseMapArgs(r)
 	indir, glob := lib.ParseGlob(data.Indir)
 	outdir := data.Outdir
+	assert(strings.HasPrefix(indir, "s4://"), fmt.Sprintf("indir must start with s4://, got: %s", indir))
 	assert(strings.HasSuffix(indir, "/"), fmt.Sprintf("indir not a directory: %s", indir))
 	assert(strings.HasSuffix(outdir, "/"), fmt.Sprintf("outdir not a directory: %s", outdir))
 	assert(strings.HasPrefix(outdir, "s4://"), fmt.Sprintf("outdir must start with s4://, got: %s", outdir))
-	pth := strings.SplitN(indir, "://", 2)[1]
+	pth := strings.TrimPrefix(indir, "s4://")
 	files, _ := listRecursive(pth, true)
-	pth = strings.SplitN(pth, "/", 2)[1]
+	pth = pth[strings.Index(pth, "/")+1:]
 	if strings.HasPrefix(data.Cmd, "while read") {
 		data.Cmd = fmt.Sprintf("cat | %s", data.Cmd)
 	}
@@ -390,10 +475,17 @@ func mapToNHandler(w http.ResponseWriter, r *http.Request, this lib.Server, serv
 			}
 		}
 		inkey := lib.Join(indir, key)
-		inpath := panic2(filepath.Abs(strings.SplitN(inkey, "s4://", 2)[1])).(string)
+		inpath := panic2(filepath.Abs(strings.TrimPrefix(inkey, "s4://"))).(string)
 		go func(inpath string) {
 			lib.With(cpuPool, func() {
-				result := lib.WarnTempdir(fmt.Sprintf("export filename=%s; < %s %s", path.Base(inpath), inpath, data.Cmd))
+				f, err := os.Open(inpath)
+				if err != nil {
+					results <- MapToNResult{&lib.WarnResultTempdir{Stderr: err.Error(), Err: err}, inpath, outdir}
+					return
+				}
+				defer func() { _ = f.Close() }()
+				result := lib.WarnTempdirStreamIn(f, "export filename=%s; %s", path.Base(inpath), data.Cmd)
+				trackTemp(result.Tempdir)
 				results <- MapToNResult{result, inpath, outdir}
 			})
 		}(inpath)
@@ -402,51 +494,69 @@ func mapToNHandler(w http.ResponseWriter, r *http.Request, this lib.Server, serv
 	var tempdirs []string
 	defer cleanup(&tempdirs)
 	timeout := time.After(lib.MaxTimeout)
-	fail := make(chan error)
+	fail := make(chan error, 1)
 	var wg sync.WaitGroup
-	wg.Add(1)
-	go func() {
-		for i := 0; i < count; i++ {
-			result := <-results
+	for i := 0; i < count; i++ {
+		var err error
+		select {
+		case result := <-results:
 			tempdirs = append(tempdirs, result.WarnResult.Tempdir)
 			if result.WarnResult.Err != nil {
-				fail <- fmt.Errorf(result.WarnResult.Stdout + "\n" + result.WarnResult.Stderr)
+				err = fmt.Errorf(result.WarnResult.Stdout + "\n" + result.WarnResult.Stderr)
 				break
-			} else {
-				for _, tempPath := range strings.Split(result.WarnResult.Stdout, "\n") {
-					if tempPath != "" {
-						wg.Add(1)
-						tempPath = lib.Join(result.WarnResult.Tempdir, tempPath)
-						outkey := lib.Join(result.Outdir, path.Base(result.Inpath), path.Base(tempPath))
-						go mapToNPut(&wg, fail, tempPath, outkey, this, servers)
-					}
+			}
+			var tempPaths []string
+			var outkeys []string
+			for _, tempPath := range strings.Split(result.WarnResult.Stdout, "\n") {
+				if tempPath != "" {
+					tempPath = lib.Join(result.WarnResult.Tempdir, tempPath)
+					tempPaths = append(tempPaths, tempPath)
+					outkeys = append(outkeys, lib.Join(result.Outdir, path.Base(result.Inpath), path.Base(tempPath)))
 				}
 			}
+			var picked []lib.Server
+			picked, err = lib.PickServers(outkeys, servers)
+			if err != nil {
+				break
+			}
+			for i, outkey := range outkeys {
+				wg.Add(1)
+				go mapToNPut(&wg, fail, tempPaths[i], outkey, picked[i] == this, this, servers)
+			}
+		case err = <-fail:
+		case <-timeout:
+			w.WriteHeader(429)
+			return
 		}
-		wg.Done()
-	}()
+		if err != nil {
+			w.WriteHeader(500)
+			panic2(fmt.Fprintf(w, "%s", err))
+			return
+		}
+	}
 	select {
 	case err := <-fail:
 		w.WriteHeader(500)
 		panic2(fmt.Fprintf(w, "%s", err))
 	case <-lib.Await(&wg):
-		w.WriteHeader(200)
+		select {
+		case err := <-fail:
+			w.WriteHeader(500)
+			panic2(fmt.Fprintf(w, "%s", err))
+		default:
+			w.WriteHeader(200)
+		}
 	case <-timeout:
 		w.WriteHeader(429)
 	}
 }
 
-func mapToNPut(wg *sync.WaitGroup, fail chan<- error, tempPath string, outkey string, this lib.Server, servers []lib.Server) {
+func mapToNPut(wg *sync.WaitGroup, fail chan<- error, tempPath string, outkey string, onThisServer bool, this lib.Server, servers []lib.Server) {
 	defer wg.Done()
-	onThisServer, err := lib.OnThisServer(outkey, this, servers)
-	if err != nil {
-		fail <- err
-		return
-	}
 	if onThisServer {
 		err := localPut(tempPath, outkey, this, servers)
 		if err != nil {
-			fail <- err
+			sendFail(fail, err)
 		}
 	} else {
 		err := lib.Retry(func() error {
@@ -455,27 +565,33 @@ func mapToNPut(wg *sync.WaitGroup, fail chan<- error, tempPath string, outkey st
 				err = s4.PutFile(tempPath, outkey, servers)
 			})
 			if errors.Is(err, s4.Err409) {
-				fail <- err
+				sendFail(fail, err)
 				return nil
 			}
 			return err
 		})
 		if err != nil {
-			fail <- err
+			sendFail(fail, err)
 		}
 	}
 }
 
+func sendFail(fail chan<- error, err error) {
+	select {
+	case fail <- err:
+	default:
+	}
+}
+
 func mapFromNHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
-	var data lib.MapArgs
-	bytes := panic2(ioutil.ReadAll(r.Body)).([]byte)
-	panic1(json.Unmarshal(bytes, &data))
+	data := lib.ParseMapArgs(r)
 	indir, glob := lib.ParseGlob(data.Indir)
 	outdir := data.Outdir
+	assert(strings.HasPrefix(indir, "s4://"), fmt.Sprintf("indir must start with s4://, got: %s", indir))
 	assert(strings.HasSuffix(indir, "/"), fmt.Sprintf("indir not a directory: %s", indir))
 	assert(strings.HasSuffix(outdir, "/"), fmt.Sprintf("outdir not a directory: %s", outdir))
 	assert(strings.HasPrefix(outdir, "s4://") && strings.HasSuffix(outdir, "/"), outdir)
-	pth := strings.Split(indir, "://")[1]
+	pth := strings.TrimPrefix(indir, "s4://")
 	files, _ := listRecursive(pth, true)
 	parts := strings.SplitN(pth, "/", 2)
 	bucket := parts[0]
@@ -483,6 +599,7 @@ func mapFromNHandler(w http.ResponseWriter, r *http.Request, this lib.Server, se
 	if strings.HasPrefix(data.Cmd, "while read") {
 		data.Cmd = fmt.Sprintf("cat | %s", data.Cmd)
 	}
+	base := panic2(filepath.Abs(lib.Join(bucket, indir))).(string)
 	prefixes := make(map[string][]string)
 	for _, file := range *files {
 		key := file.Path
@@ -496,79 +613,44 @@ func mapFromNHandler(w http.ResponseWriter, r *http.Request, this lib.Server, se
 			}
 		}
 		prefix := lib.KeyPrefix(key)
-		prefixes[prefix] = append(prefixes[prefix], panic2(filepath.Abs(lib.Join(bucket, indir, key))).(string))
+		prefixes[prefix] = append(prefixes[prefix], lib.Join(base, key))
 	}
 	results := make(chan MapResult, len(prefixes))
 	for prefix, inpaths := range prefixes {
 		outkey := lib.Join(outdir, prefix+lib.Suffix(inpaths))
 		go func(inpaths []string) {
+			var result *lib.WarnResultTempdir
+			var checksum string
 			lib.With(cpuPool, func() {
 				stdin := strings.NewReader(strings.Join(inpaths, "\n") + "\n")
-				result := lib.WarnTempdirStreamIn(stdin, fmt.Sprintf("%s > output", data.Cmd))
-				results <- MapResult{result, outkey}
+				result, checksum = lib.WarnTempdirOutput(stdin, "%s", data.Cmd)
+				trackTemp(result.Tempdir)
 			})
+			results <- mapPut(result, checksum, outkey, this, servers)
 		}(inpaths)
 	}
-	var tempdirs []string
-	defer cleanup(&tempdirs)
-	timeout := time.After(lib.MaxTimeout)
-	jobs := make(chan error, len(prefixes))
-	fail := make(chan error, 1)
-	go func() {
-		for range prefixes {
-			result := <-results
-			tempdirs = append(tempdirs, result.WarnResult.Tempdir)
-			if result.WarnResult.Err != nil {
-				fail <- fmt.Errorf(result.WarnResult.Stdout + "\n" + result.WarnResult.Stderr)
-				break
-			} else {
-				go func(result MapResult) {
-					tempPath := lib.Join(result.WarnResult.Tempdir, "output")
-					err := localPut(tempPath, result.Outkey, this, servers)
-					if err != nil {
-						fail <- err
-					} else {
-						jobs <- nil
-					}
-				}(result)
-			}
-		}
-	}()
-	for range prefixes {
-		select {
-		case <-jobs:
-		case err := <-fail:
-			w.WriteHeader(500)
-			panic2(fmt.Fprintf(w, "%s", err))
-			return
-		case <-timeout:
-			w.WriteHeader(429)
-			return
-		}
-	}
-	w.WriteHeader(200)
+	awaitMapResults(w, results, len(prefixes))
 }
 
 func evalHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
 	key := lib.QueryParam(r, "key")
 	assert(panic2(lib.OnThisServer(key, this, servers)).(bool), "wrong server for request")
 	cmd := panic2(ioutil.ReadAll(r.Body)).([]byte)
-	path := strings.SplitN(key, "s4://", 2)[1]
-	var exists bool
-	lib.With(soloPool, func() {
-		exists = panic2(lib.Exists(path)).(bool)
-	})
+	path := strings.TrimPrefix(key, "s4://")
+	exists := panic2(lib.Exists(path)).(bool)
 	if !exists {
 		w.WriteHeader(404)
 	} else {
+		f := panic2(os.Open(path)).(*os.File)
+		defer func() { _ = f.Close() }()
 		lib.With(cpuPool, func() {
-			res := lib.Warn("< %s %s", path, cmd)
+			res := lib.WarnStreamIn(f, "%s", cmd)
 			if res.Err != nil {
 				w.WriteHeader(500)
-				panic2(fmt.Fprintf(w, res.Stdout+"\n"+res.Stderr))
+				panic2(io.WriteString(w, res.Stdout+"\n"+res.Stderr))
 			} else {
 				w.WriteHeader(200)
-				panic2(fmt.Fprintf(w, res.Stdout))
+				panic2(io.WriteString(w, res.Stdout))
 			}
 		})
 	}
@@ -592,11 +674,17 @@ func listRecursive(prefix string, stripBucket bool) (*[]*File, *[]*File) {
 		panic1(filepath.Walk(root, func(fullpath string, info os.FileInfo, err error) error {
 			panic1(err)
 			matched := strings.HasPrefix(fullpath, prefix)
+			if !matched && info.IsDir() && !strings.HasPrefix(prefix, fullpath+"/") {
+				return filepath.SkipDir
+			}
 			isChecksum := lib.IsChecksum(fullpath)
 			if matched && !isChecksum {
 				path := fullpath
 				if stripBucket {
-					path = strings.Join(strings.Split(fullpath, "/")[1:], "/")
+					path = ""
+					if i := strings.Index(fullpath, "/"); i != -1 {
+						path = fullpath[i+1:]
+					}
 				}
 				if info.IsDir() {
 					dirs = append(dirs, &File{info.ModTime(), "", path})
@@ -618,7 +706,7 @@ func list(prefix string) *[]*File {
 	var res []*File
 	_, err := os.Stat(root)
 	if err == nil {
-		for _, info := range panic2(ioutil.ReadDir(root)).([]os.FileInfo) {
+		for _, info := range readDir(root) {
 			name := info.Name()
 			matched := strings.HasPrefix(lib.Join(root, name), prefix)
 			isChecksum := lib.IsChecksum(name)
@@ -634,11 +722,34 @@ func list(prefix string) *[]*File {
 	return &res
 }
 
+func readDir(root string) []os.FileInfo {
+	f := panic2(os.Open(root)).(*os.File)
+	defer func() { panic1(f.Close()) }()
+	return panic2(f.Readdir(-1)).([]os.FileInfo)
+}
+
+func formatModTime(t time.Time) (string, string) {
+	s := t.Format(time.RFC3339)
+	return s[:10], s[11:]
+}
+
 func listHandler(w http.ResponseWriter, r *http.Request) {
 	prefix := lib.QueryParam(r, "prefix")
 	assert(strings.HasPrefix(prefix, "s4://"), prefix)
-	prefix = strings.Split(prefix, "s4://")[1]
+	prefix = strings.TrimPrefix(prefix, "s4://")
 	recursive := lib.QueryParamDefault(r, "recursive", "false") == "true"
+	if recursive && prefix != "" && strings.Index(prefix, "/") == len(prefix)-1 {
+		body := cachedBucketList(prefix, func() []byte {
+			return encodeJSON(listRows(prefix, recursive))
+		})
+		w.Header().Set("Content-Type", "application/json")
+		panic2(w.Write(body))
+		return
+	}
+	writeJSON(w, listRows(prefix, recursive))
+}
+
+func listRows(prefix string, recursive bool) [][]string {
 	var res *[]*File
 	lib.With(miscPool, func() {
 		if recursive {
@@ -647,40 +758,76 @@ func listHandler(w http.ResponseWriter, r *http.Request) {
 			res = list(prefix)
 		}
 	})
-	var vals [][]string
+	vals := make([][]string, 0, len(*res))
 	for _, file := range *res {
-		parts := []string{"", ""}
+		date, clock := "", ""
 		if file.Size != "PRE" {
-			parts = strings.SplitN(file.ModTime.Format(time.RFC3339), "T", 2)
+			date, clock = formatModTime(file.ModTime)
 		}
-		vals = append(vals, []string{parts[0], parts[1], file.Size, file.Path})
+		vals = append(vals, []string{date, clock, file.Size, file.Path})
+	}
+	return vals
+}
+
+var bucketListCache = lib.NewCache(1<<10, 2*time.Second)
+
+func cachedBucketList(bucket string, fn func() []byte) []byte {
+	val, gen, ok := bucketListCache.Get(bucket)
+	if ok {
+		return val.([]byte)
+	}
+	body := fn()
+	bucketListCache.Fill(gen, bucket, body)
+	return body
+}
+
+func forgetBucketList(path string) {
+	if i := strings.Index(path, "/"); i != -1 {
+		bucketListCache.Delete(path[:i+1])
+	} else {
+		bucketListCache.Clear()
 	}
-	w.Header().Set("Content-Type", "application/json")
-	bytes := panic2(json.Marshal(vals))
-	panic2(w.Write(bytes.([]byte)))
 }
 
 func listBucketsHandler(w http.ResponseWriter) {
 	var res [][]string
-	for _, info := range panic2(ioutil.ReadDir(".")).([]os.FileInfo) {
+	for _, info := range readDir(".") {
 		name := info.Name()
 		if info.IsDir() && !strings.HasPrefix(name, "_") {
-			parts := strings.SplitN(info.ModTime().Format(time.RFC3339), "T", 2)
-			res = append(res, []string{parts[0], parts[1], fmt.Sprint(info.Size()), name})
+			date, clock := formatModTime(info.ModTime())
+			res = append(res, []string{date, clock, fmt.Sprint(info.Size()), name})
 		}
 	}
+	writeJSON(w, res)
+}
+
+func writeJSON(w http.ResponseWriter, v interface{}) {
 	w.Header().Set("Content-Type", "application/json")
-	bytes := panic2(json.Marshal(res))
-	panic2(w.Write(bytes.([]byte)))
+	enc := json.NewEncoder(w)
+	enc.SetEscapeHTML(false)
+	panic1(enc.Encode(v))
 }
 
+func encodeJSON(v interface{}) []byte {
+	var buf bytes.Buffer
+	enc := json.NewEncoder(&buf)
+	enc.SetEscapeHTML(false)
+	panic1(enc.Encode(v))
+	return buf.Bytes()
+}
+
+var (
+	healthyBody  = []byte("healthy\n")
+	notFoundBody = []byte("404\n")
+)
+
 func healthHandler(w http.ResponseWriter) {
-	panic2(fmt.Fprintf(w, "healthy\n"))
+	panic2(w.Write(healthyBody))
 }
 
 func notFoundHandler(w http.ResponseWriter) {
 	w.WriteHeader(404)
-	panic2(fmt.Fprintf(w, "404\n"))
+	panic2(w.Write(notFoundBody))
 }
 
 func expireJobs() {
@@ -714,24 +861,49 @@ func expireJobs() {
 	})
 }
 
-func expireFiles() {
-	root := "_tempfiles"
-	for _, info := range panic2(ioutil.ReadDir(root)).([]os.FileInfo) {
-		if time.Since(info.ModTime()) > lib.MaxTimeout {
-			path := lib.Join(root, info.Name())
-			lib.Logger.Printf("gc expired tempfile: %s\n", path)
-			_ = os.Remove(path)
+var (
+	tempCreated   = make(map[string]time.Time)
+	tempCreatedMu sync.Mutex
+)
+
+func trackTemp(path string) {
+	if path == "" {
+		return
+	}
+	tempCreatedMu.Lock()
+	tempCreated[path] = time.Now()
+	tempCreatedMu.Unlock()
+}
+
+func untrackTemp(path string) {
+	tempCreatedMu.Lock()
+	delete(tempCreated, path)
+	tempCreatedMu.Unlock()
+}
+
+func expireTemps() {
+	var expired []string
+	tempCreatedMu.Lock()
+	for path, created := range tempCreated {
+		if time.Since(created) > lib.MaxTimeout {
+			expired = append(expired, path)
+			delete(tempCreated, path)
 		}
 	}
+	tempCreatedMu.Unlock()
+	for _, path := range expired {
+		lib.Logger.Printf("gc expired temp: %s\n", path)
+		_ = os.RemoveAll(path)
+	}
 }
 
-func expireDirs() {
-	root := "_tempdirs"
-	for _, info := range panic2(ioutil.ReadDir(root)).([]os.FileInfo) {
-		if time.Since(info.ModTime()) > lib.MaxTimeout {
-			path := lib.Join(root, info.Name())
-			lib.Logger.Printf("gc expired tempdir: %s\n", path)
-			_ = os.RemoveAll(path)
+func clearTemps() {
+	for _, root := range []string{"_tempfiles", "_tempdirs"} {
+		for _, info := range readDir(root) {
+			err := os.RemoveAll(lib.Join(root, info.Name()))
+			if err != nil {
+				lib.Logger.Println("clear temp error:", err)
+			}
 		}
 	}
 }
@@ -739,8 +911,7 @@ func expireDirs() {
 func expiredDataDeleter() {
 	for {
 		expireJobs()
-		expireFiles()
-		expireDirs()
+		expireTemps()
 		time.Sleep(time.Second * 5)
 	}
 }
@@ -750,7 +921,26 @@ func initPools(maxIOJobs int, maxCPUJobs int) {
 	ioRecvPool = semaphore.NewWeighted(int64(maxIOJobs))
 	cpuPool = semaphore.NewWeighted(int64(maxCPUJobs))
 	miscPool = semaphore.NewWeighted(int64(maxCPUJobs))
-	soloPool = semaphore.NewWeighted(int64(1))
+}
+
+func withSolo(fn func()) {
+	soloLock.Lock()
+	defer soloLock.Unlock()
+	fn()
+}
+
+var soloDirs = lib.NewCache(1<<16, 0)
+
+func mkdirSolo(dir string) error {
+	if _, _, ok := soloDirs.Get(dir); ok {
+		return nil
+	}
+	err := os.MkdirAll(dir, os.ModePerm)
+	if err != nil {
+		return err
+	}
+	soloDirs.Set(dir, true)
+	return nil
 }
 
 func rootHandler(w http.ResponseWriter, r *http.Request, this lib.Server, servers []lib.Server) {
@@ -799,13 +989,16 @@ func main() {
 	panic1(os.MkdirAll("s4_data/_tempfiles", os.ModePerm))
 	panic1(os.MkdirAll("s4_data/_tempdirs", os.ModePerm))
 	panic1(os.Chdir("s4_data"))
+	clearTemps()
 	numCpus := runtime.GOMAXPROCS(0)
 	port := flag.Int("port", 0, "specify port instead of matching a single conf entry by ipv4")
 	maxIOJobs := flag.Int("max-io-jobs", numCpus*4, "specify max-io-jobs to use instead of cpus*4")
 	maxCPUJobs := flag.Int("max-cpu-jobs", numCpus+2, "specify max-cpu-jobs to use instead of cpus+2")
 	confPath := flag.String("conf", lib.DefaultConfPath(), "specify conf path to use instead of ~/.s4.conf")
+	flag.BoolVar(&verifyDisk, "verify-disk", false, "after each put, drop the file from page cache and verify its checksum from disk")
 	flag.Parse()
 	initPools(*maxIOJobs, *maxCPUJobs)
+	lib.SetMaxIOJobs(*maxIOJobs)
 	servers := panic2(lib.GetServers(*confPath)).([]lib.Server)
 	this := lib.ThisServer(*port, servers)
 	portStr := fmt.Sprintf(":%s", this.Port)
@@ -6,7 +6,6 @@ require (
 	github.com/avast/retry-go v2.6.1+incompatible
 	github.com/cespare/xxhash v1.1.0
 	github.com/niemeyer/pretty v0.0.0-20200227124842-a10e7caefd8e // indirect
-	github.com/satori/go.uuid v1.2.0
 	github.com/stretchr/testify v1.6.1 // indirect
 	golang.org/x/crypto v0.0.0-20200820211705-5c72a883971a
 	golang.org/x/sync v0.0.0-20200930132711-30421366ff76
@@ -0,0 +1,20 @@
+//go:build linux && (amd64 || arm64)
+// +build linux
+// +build amd64 arm64
+
+package lib
+
+import (
+	"os"
+	"syscall"
+)
+
+const fadvDontNeed = 4
+
+func dropCache(f *os.File) error {
+	_, _, errno := syscall.Syscall6(syscall.SYS_FADVISE64, f.Fd(), 0, 0, fadvDontNeed, 0, 0)
+	if errno != 0 {
+		return errno
+	}
+	return nil
+}
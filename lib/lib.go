@@ -12,11 +12,13 @@ import (
 	"log"
 	"net"
 	"net/http"
+	"net/url"
 	"os"
 	"os/exec"
 	"os/user"
 	"path"
 	"path/filepath"
+	"runtime"
 	"strconv"
 	"strings"
 	"sync"
@@ -24,27 +26,65 @@ import (
 
 	"github.com/avast/retry-go"
 	"github.com/cespare/xxhash"
-	uuid "github.com/satori/go.uuid"
 	"golang.org/x/crypto/blake2s"
 	"golang.org/x/sync/semaphore"
 )
 
 const (
-	Timeout    = 5 * time.Minute
-	MaxTimeout = Timeout*2 + 15*time.Second
-	bufSize    = 4096
-	ioTimeout  = 5 * time.Second
+	Timeout       = 5 * time.Minute
+	MaxTimeout    = Timeout*2 + 15*time.Second
+	bufSize       = 4096
+	sendfileChunk = 64 * 1024
+	ioTimeout     = 5 * time.Second
 )
 
 var (
-	client = http.Client{Timeout: MaxTimeout}
+	Transport = &http.Transport{
+		Proxy: http.ProxyFromEnvironment,
+		DialContext: (&net.Dialer{
+			Timeout:   30 * time.Second,
+			KeepAlive: 30 * time.Second,
+		}).DialContext,
+		MaxIdleConns:        100,
+		MaxIdleConnsPerHost: maxIdleConnsPerHost(runtime.GOMAXPROCS(0) * 4),
+		IdleConnTimeout:     90 * time.Second,
+		TLSHandshakeTimeout: 10 * time.Second,
+	}
+	client = http.Client{Timeout: MaxTimeout, Transport: Transport}
 	Logger = log.New(os.Stdout, "", log.Ldate|log.Ltime)
 )
 
+func maxIdleConnsPerHost(maxIOJobs int) int {
+	if maxIOJobs < 10 {
+		return 10
+	}
+	return maxIOJobs
+}
+
+func SetMaxIOJobs(maxIOJobs int) {
+	Transport.MaxIdleConnsPerHost = maxIdleConnsPerHost(maxIOJobs)
+	if Transport.MaxIdleConns < Transport.MaxIdleConnsPerHost {
+		Transport.MaxIdleConns = Transport.MaxIdleConnsPerHost
+	}
+}
+
 type MapArgs struct {
-	Cmd    string `json:"cmd"`
-	Indir  string `json:"indir"`
-	Outdir string `json:"outidr"`
+	Cmd    string
+	Indir  string
+	Outdir string
+}
+
+func (a MapArgs) Encode() []byte {
+	return []byte(url.Values{"cmd": {a.Cmd}, "indir": {a.Indir}, "outdir": {a.Outdir}}.Encode())
+}
+
+func ParseMapArgs(r *http.Request) MapArgs {
+	panic1(r.ParseForm())
+	return MapArgs{
+		Cmd:    r.PostForm.Get("cmd"),
+		Indir:  r.PostForm.Get("indir"),
+		Outdir: r.PostForm.Get("outdir"),
+	}
 }
 
 func DefaultConfPath() string {
@@ -52,8 +92,27 @@ func DefaultConfPath() string {
 	if env != "" {
 		return env
 	}
-	usr := panic2(user.Current()).(*user.User)
-	return Join(usr.HomeDir, ".s4.conf")
+	home, err := os.UserHomeDir()
+	if err != nil {
+		home = panic2(user.Current()).(*user.User).HomeDir
+	}
+	return Join(home, ".s4.conf")
+}
+
+var (
+	bashPathOnce sync.Once
+	bashPath     string
+)
+
+func bash(str string) *exec.Cmd {
+	bashPathOnce.Do(func() {
+		path, err := exec.LookPath("bash")
+		if err != nil {
+			path = "bash"
+		}
+		bashPath = path
+	})
+	return exec.Command(bashPath, "-c", str)
 }
 
 type WarnResult struct {
@@ -62,32 +121,45 @@ type WarnResult struct {
 	Err    error
 }
 
-func Warn(format string, args ...interface{}) *WarnResult {
+func WarnStreamIn(stdin io.Reader, format string, args ...interface{}) *WarnResult {
 	str := fmt.Sprintf(format, args...)
-	str = fmt.Sprintf("set -eou pipefail; %s", str)
-	cmd := exec.Command("bash", "-c", str)
+	cmd := bash("set -eou pipefail; " + str)
+	cmd.Stdin = stdin
+	return runTimeout(cmd)
+}
+
+var errCmdTimeout = errors.New("cmd timeout")
+
+func runTimeout(cmd *exec.Cmd) *WarnResult {
 	var stdout bytes.Buffer
-	cmd.Stdout = &stdout
+	if cmd.Stdout == nil {
+		cmd.Stdout = &stdout
+	}
 	var stderr bytes.Buffer
 	cmd.Stderr = &stderr
-	result := make(chan *WarnResult)
+	err := cmd.Start()
+	if err != nil {
+		return &WarnResult{"", "", err}
+	}
+	done := make(chan error, 1)
 	go func() {
-		err := cmd.Run()
-		result <- &WarnResult{
+		done <- cmd.Wait()
+	}()
+	timer := time.NewTimer(Timeout)
+	defer timer.Stop()
+	select {
+	case err := <-done:
+		return &WarnResult{
 			strings.TrimRight(stdout.String(), "\n"),
 			strings.TrimRight(stderr.String(), "\n"),
 			err,
 		}
-	}()
-	select {
-	case r := <-result:
-		return r
-	case <-time.After(Timeout):
+	case <-timer.C:
 		_ = cmd.Process.Kill()
 		return &WarnResult{
 			"",
 			"",
-			errors.New("cmd timeout"),
+			errCmdTimeout,
 		}
 	}
 }
@@ -99,73 +171,43 @@ type WarnResultTempdir struct {
 	Tempdir string
 }
 
-func WarnTempdir(format string, args ...interface{}) *WarnResultTempdir {
+func WarnTempdirStreamIn(stdin io.Reader, format string, args ...interface{}) *WarnResultTempdir {
 	tempdir := panic2(ioutil.TempDir("_tempdirs", "")).(string)
-	str := fmt.Sprintf(format, args...)
-	str = fmt.Sprintf("set -eou pipefail; cd %s; %s", tempdir, str)
-	cmd := exec.Command("bash", "-c", str)
-	var stdout bytes.Buffer
-	cmd.Stdout = &stdout
-	var stderr bytes.Buffer
-	cmd.Stderr = &stderr
-	result := make(chan *WarnResultTempdir)
-	go func() {
-		err := cmd.Run()
-		result <- &WarnResultTempdir{
-			strings.TrimRight(stdout.String(), "\n"),
-			strings.TrimRight(stderr.String(), "\n"),
-			err,
-			tempdir,
-		}
-	}()
-	select {
-	case r := <-result:
-		return r
-	case <-time.After(Timeout):
-		_ = cmd.Process.Kill()
-		panic1(os.RemoveAll(tempdir))
-		return &WarnResultTempdir{
-			"",
-			"",
-			errors.New("cmd timeout"),
-			"",
-		}
-	}
+	cmd := bashTempdir(tempdir, format, args...)
+	cmd.Stdin = stdin
+	return tempdirResult(runTimeout(cmd), tempdir)
 }
 
-func WarnTempdirStreamIn(stdin io.Reader, format string, args ...interface{}) *WarnResultTempdir {
+func WarnTempdirOutput(stdin io.Reader, format string, args ...interface{}) (*WarnResultTempdir, string) {
 	tempdir := panic2(ioutil.TempDir("_tempdirs", "")).(string)
-	str := fmt.Sprintf(format, args...)
-	str = fmt.Sprintf("set -eou pipefail; cd %s; %s", tempdir, str)
-	cmd := exec.Command("bash", "-c", str)
+	cmd := bashTempdir(tempdir, format, args...)
 	cmd.Stdin = stdin
-	var stdout bytes.Buffer
-	cmd.Stdout = &stdout
-	var stderr bytes.Buffer
-	cmd.Stderr = &stderr
-	result := make(chan *WarnResultTempdir)
-	go func() {
-		err := cmd.Run()
-		result <- &WarnResultTempdir{
-			strings.TrimRight(stdout.String(), "\n"),
-			strings.TrimRight(stderr.String(), "\n"),
-			err,
-			tempdir,
-		}
-	}()
-	select {
-	case r := <-result:
-		return r
-	case <-time.After(Timeout):
-		_ = cmd.Process.Kill()
+	f := panic2(os.Create(Join(tempdir, "output"))).(*os.File)
+	h := xxhash.New()
+	cmd.Stdout = io.MultiWriter(f, h)
+	r := runTimeout(cmd)
+	checksum := ""
+	if r.Err == nil {
+		checksum = fmt.Sprintf("%x", h.Sum64())
+		r.Err = f.Chmod(0o444)
+	}
+	_ = f.Close()
+	return tempdirResult(r, tempdir), checksum
+}
+
+func bashTempdir(tempdir string, format string, args ...interface{}) *exec.Cmd {
+	str := fmt.Sprintf(format, args...)
+	cmd := bash("set -eou pipefail; " + str)
+	cmd.Dir = tempdir
+	return cmd
+}
+
+func tempdirResult(r *WarnResult, tempdir string) *WarnResultTempdir {
+	if r.Err == errCmdTimeout {
 		panic1(os.RemoveAll(tempdir))
-		return &WarnResultTempdir{
-			"",
-			"",
-			errors.New("cmd timeout"),
-			"",
-		}
+		tempdir = ""
 	}
+	return &WarnResultTempdir{r.Stdout, r.Stderr, r.Err, tempdir}
 }
 
 type Server struct {
@@ -193,11 +235,8 @@ func GetServers(confPath string) ([]Server, error) {
 			return []Server{}, fmt.Errorf("bad config line: %s", line)
 		}
 		server := Server{parts[0], parts[1]}
-		for _, address := range localAddresses {
-			if server.Address == address {
-				server.Address = "0.0.0.0"
-				break
-			}
+		if localAddresses[server.Address] {
+			server.Address = "0.0.0.0"
 		}
 		servers = append(servers, server)
 	}
@@ -207,19 +246,32 @@ func GetServers(confPath string) ([]Server, error) {
 	return servers, nil
 }
 
-func localAddresses() ([]string, error) {
-	vals := []string{"0.0.0.0", "localhost", "127.0.0.1"}
+var (
+	localAddressesOnce sync.Once
+	localAddressesSet  map[string]bool
+	localAddressesErr  error
+)
+
+func localAddresses() (map[string]bool, error) {
+	localAddressesOnce.Do(func() {
+		localAddressesSet, localAddressesErr = listLocalAddresses()
+	})
+	return localAddressesSet, localAddressesErr
+}
+
+func listLocalAddresses() (map[string]bool, error) {
+	vals := map[string]bool{"0.0.0.0": true, "localhost": true, "127.0.0.1": true}
 	ifaces, err := net.Interfaces()
 	if err != nil {
-		return []string{}, err
+		return nil, err
 	}
 	for _, i := range ifaces {
 		addrs, err := i.Addrs()
 		if err != nil {
-			return []string{}, err
+			return nil, err
 		}
 		for _, addr := range addrs {
-			vals = append(vals, strings.SplitN(addr.String(), "/", 2)[0])
+			vals[strings.SplitN(addr.String(), "/", 2)[0]] = true
 		}
 	}
 	return vals, nil
@@ -232,36 +284,27 @@ type HTTPResult struct {
 }
 
 func Post(url, contentType string, body io.Reader) *HTTPResult {
-	var err error
-	var resp *http.Response
-	var respBody []byte
-	resp, err = client.Post(url, contentType, body)
-	if err == nil {
-
-		respBody, err = ioutil.ReadAll(resp.Body)
-		_ = resp.Body.Close()
-		if err != nil {
-			return &HTTPResult{-1, []byte{}, err}
-		}
-		return &HTTPResult{resp.StatusCode, respBody, nil}
-	}
-	return &HTTPResult{-1, []byte{}, err}
+	return readResponse(client.Post(url, contentType, body))
 }
 
 func Get(url string) *HTTPResult {
-	var err error
-	var resp *http.Response
-	var respBody []byte
-	resp, err = client.Get(url)
-	if err == nil {
-		respBody, err = ioutil.ReadAll(resp.Body)
-		_ = resp.Body.Close()
-		if err != nil {
-			return &HTTPResult{-1, []byte{}, err}
-		}
-		return &HTTPResult{resp.StatusCode, respBody, nil}
+	return readResponse(client.Get(url))
+}
+
+func readResponse(resp *http.Response, err error) *HTTPResult {
+	if err != nil {
+		return &HTTPResult{-1, []byte{}, err}
+	}
+	defer func() { _ = resp.Body.Close() }()
+	var buf bytes.Buffer
+	if resp.ContentLength > 0 {
+		buf.Grow(int(resp.ContentLength) + bytes.MinRead)
+	}
+	_, err = buf.ReadFrom(resp.Body)
+	if err != nil {
+		return &HTTPResult{-1, []byte{}, err}
 	}
-	return &HTTPResult{-1, []byte{}, err}
+	return &HTTPResult{resp.StatusCode, buf.Bytes(), nil}
 }
 
 type rwcCallback struct {
@@ -292,6 +335,93 @@ func hash(str string) uint64 {
 	return binary.LittleEndian.Uint64(h[:])
 }
 
+type cacheEntry struct {
+	expires time.Time
+	val     interface{}
+}
+
+type Cache struct {
+	mu    sync.Mutex
+	size  int
+	ttl   time.Duration
+	gen   uint64
+	items map[string]cacheEntry
+}
+
+func NewCache(size int, ttl time.Duration) *Cache {
+	return &Cache{size: size, ttl: ttl, items: make(map[string]cacheEntry)}
+}
+
+func (c *Cache) Get(key string) (interface{}, uint64, bool) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	entry, ok := c.items[key]
+	if ok && c.ttl != 0 && !time.Now().Before(entry.expires) {
+		delete(c.items, key)
+		ok = false
+	}
+	return entry.val, c.gen, ok
+}
+
+func (c *Cache) Set(key string, val interface{}) {
+	c.mu.Lock()
+	c.gen++
+	c.store(key, val)
+	c.mu.Unlock()
+}
+
+func (c *Cache) Fill(gen uint64, key string, val interface{}) {
+	c.mu.Lock()
+	if gen == c.gen {
+		c.store(key, val)
+	}
+	c.mu.Unlock()
+}
+
+func (c *Cache) store(key string, val interface{}) {
+	if len(c.items) >= c.size {
+		c.items = make(map[string]cacheEntry)
+	}
+	c.items[key] = cacheEntry{time.Now().Add(c.ttl), val}
+}
+
+func (c *Cache) Delete(key string) {
+	c.mu.Lock()
+	c.gen++
+	delete(c.items, key)
+	c.mu.Unlock()
+}
+
+func (c *Cache) DeleteFunc(fn func(key string) bool) {
+	c.mu.Lock()
+	c.gen++
+	for key := range c.items {
+		if fn(key) {
+			delete(c.items, key)
+		}
+	}
+	c.mu.Unlock()
+}
+
+func (c *Cache) Clear() {
+	c.mu.Lock()
+	c.gen++
+	c.items = make(map[string]cacheEntry)
+	c.mu.Unlock()
+}
+
+var hashCache = NewCache(1<<16, 0)
+
+func cachedHash(str string) uint64 {
+	val, gen, ok := hashCache.Get(str)
+	if ok {
+		return val.(uint64)
+	}
+	h := hash(str)
+	hashCache.Fill(gen, str, h)
+	return h
+}
+
 func OnThisServer(key string, this Server, servers []Server) (bool, error) {
 	if !strings.HasPrefix(key, "s4://") {
 		return false, fmt.Errorf("missing s4:// prefix: %s", key)
@@ -304,22 +434,51 @@ func OnThisServer(key string, this Server, servers []Server) (bool, error) {
 }
 
 func PickServer(key string, servers []Server) (Server, error) {
+	err := checkKey(key)
+	if err != nil {
+		return Server{}, err
+	}
+	return servers[serverIndex(KeyPrefix(key), len(servers))], nil
+}
+
+func PickServers(keys []string, servers []Server) ([]Server, error) {
+	picked := make([]Server, len(keys))
+	indices := make(map[string]uint64)
+	for i, key := range keys {
+		err := checkKey(key)
+		if err != nil {
+			return []Server{}, err
+		}
+		prefix := KeyPrefix(key)
+		index, ok := indices[prefix]
+		if !ok {
+			index = serverIndex(prefix, len(servers))
+			indices[prefix] = index
+		}
+		picked[i] = servers[index]
+	}
+	return picked, nil
+}
+
+func checkKey(key string) error {
 	if strings.HasSuffix(key, "/") {
-		return Server{}, fmt.Errorf("needed key, got directory: %s", key)
+		return fmt.Errorf("needed key, got directory: %s", key)
 	}
 	if !strings.HasPrefix(key, "s4://") {
-		return Server{}, fmt.Errorf("missing s4:// prefix: %s", key)
+		return fmt.Errorf("missing s4:// prefix: %s", key)
 	}
-	prefix := KeyPrefix(key)
+	return nil
+}
+
+func serverIndex(prefix string, numServers int) uint64 {
 	tmp, err := strconv.Atoi(prefix)
 	var val uint64
 	if err != nil {
-		val = hash(prefix)
+		val = cachedHash(prefix)
 	} else {
 		val = uint64(tmp)
 	}
-	index := val % uint64(len(servers))
-	return servers[index], nil
+	return val % uint64(numServers)
 }
 
 func isDigits(str string) bool {
@@ -328,8 +487,11 @@ func isDigits(str string) bool {
 }
 
 func KeyPrefix(key string) string {
-	key = Last(strings.Split(key, "/"))
-	prefix := strings.Split(key, "_")[0]
+	key = key[strings.LastIndex(key, "/")+1:]
+	prefix := key
+	if i := strings.Index(key, "_"); i != -1 {
+		prefix = key[:i]
+	}
 	if !isDigits(prefix) {
 		prefix = key
 	}
@@ -340,10 +502,9 @@ func keySuffix(key string) (string, bool) {
 	if !isDigits(KeyPrefix(key)) {
 		return "", false
 	}
-	part := Last(strings.Split(key, "/"))
-	parts := strings.SplitN(part, "_", 2)
-	if len(parts) == 2 {
-		return parts[1], true
+	part := key[strings.LastIndex(key, "/")+1:]
+	if i := strings.Index(part, "_"); i != -1 {
+		return part[i+1:], true
 	}
 	return "", false
 }
@@ -369,17 +530,9 @@ func Suffix(keys []string) string {
 }
 
 func NewTempPath(dir string) string {
-	for i := 0; i < 5; i++ {
-		uid := uuid.NewV4().String()
-		tempPath := panic2(filepath.Abs(Join(dir, uid))).(string)
-		_, err := os.Stat(tempPath)
-		if err != nil {
-			f := panic2(os.Create(tempPath)).(*os.File)
-			panic1(f.Close())
-			return tempPath
-		}
-	}
-	panic("failure")
+	f := panic2(ioutil.TempFile(dir, "")).(*os.File)
+	panic1(f.Close())
+	return panic2(filepath.Abs(f.Name())).(string)
 }
 
 func ChecksumWrite(path string, checksum string) error {
@@ -402,13 +555,17 @@ func ChecksumRead(path string) (string, error) {
 	return string(bytes), nil
 }
 
-func Checksum(path string) (string, error) {
+func ChecksumReadOnly(path string) (string, error) {
 	f, err := os.Open(path)
 	if err != nil {
 		return "", err
 	}
-	bf := bufio.NewReaderSize(f, bufSize)
-	val := xxh(bf)
+	err = f.Chmod(0o444)
+	if err != nil {
+		_ = f.Close()
+		return "", err
+	}
+	val := xxh(bufio.NewReaderSize(f, bufSize))
 	err = f.Close()
 	if err != nil {
 		return "", err
@@ -416,11 +573,33 @@ func Checksum(path string) (string, error) {
 	return val, nil
 }
 
+func ChecksumDisk(path string) (string, error) {
+	f, err := os.Open(path)
+	if err != nil {
+		return "", err
+	}
+	defer func() { _ = f.Close() }()
+	err = f.Sync()
+	if err != nil {
+		return "", err
+	}
+	err = dropCache(f)
+	if err != nil {
+		return "", err
+	}
+	h := xxhash.New()
+	_, err = io.Copy(h, bufio.NewReaderSize(f, bufSize))
+	if err != nil {
+		return "", err
+	}
+	return fmt.Sprintf("%x", h.Sum64()), nil
+}
+
 func ChecksumPath(prefix string) (string, error) {
 	if strings.HasSuffix(prefix, "/") {
 		return "", fmt.Errorf("checksum path is not file: %s", prefix)
 	}
-	return fmt.Sprintf("%s.xxh", prefix), nil
+	return prefix + ".xxh", nil
 }
 
 func IsChecksum(path string) bool {
@@ -432,26 +611,61 @@ func Last(parts []string) string {
 }
 
 func RecvFile(path string, port chan<- string) (string, error) {
+	return recvFile(path, false, port)
+}
+
+func RecvFileReadOnly(path string, port chan<- string) (string, error) {
+	return recvFile(path, true, port)
+}
+
+func recvFile(path string, readOnly bool, port chan<- string) (string, error) {
 	f, err := os.Create(path)
 	if err != nil {
 		return "", err
 	}
-	bf := bufio.NewWriterSize(f, bufSize)
-	checksum, err := Recv(bf, port)
-	if err != nil {
-		return "", err
+	checksum, err := recv(port, func(conn net.Conn, reset func()) (string, error) {
+		return copyHashed(f, conn, f, reset)
+	})
+	if err == nil && readOnly {
+		err = f.Chmod(0o444)
 	}
-	err = bf.Flush()
 	if err != nil {
+		_ = f.Close()
+		_ = os.Remove(path)
 		return "", err
 	}
 	err = f.Close()
 	if err != nil {
+		_ = os.Remove(path)
 		return "", err
 	}
 	return checksum, nil
 }
 
+func copyHashed(dst io.Writer, src io.Reader, f *os.File, reset func()) (string, error) {
+	h := xxhash.New()
+	buf := make([]byte, sendfileChunk)
+	var off int64
+	for {
+		n, err := io.CopyN(dst, src, sendfileChunk)
+		if n > 0 {
+			reset()
+			_, rerr := f.ReadAt(buf[:n], off)
+			if rerr != nil {
+				return "", rerr
+			}
+			_, _ = h.Write(buf[:n])
+			off += n
+		}
+		if err == io.EOF {
+			return fmt.Sprintf("%x", h.Sum64()), nil
+		}
+		if err != nil {
+			return "", err
+		}
+	}
+}
+
 func resetableTimeout(duration time.Duration) (func(), <-chan error) {
 	reset := make(chan error, 1)
 	timeout := make(chan error, 1)
@@ -468,51 +682,61 @@ func resetableTimeout(duration time.Duration) (func(), <-chan error) {
 		}
 	}()
 	resetFn := func() {
-		reset <- nil
+		select {
+		case reset <- nil:
+		default:
+		}
 	}
 	return resetFn, timeout
 }
 
 func Recv(w io.Writer, port chan<- string) (string, error) {
-	fail := make(chan error)
-	checksum := make(chan string)
+	return recv(port, func(conn net.Conn, reset func()) (string, error) {
+		h := xxhash.New()
+		rwc := rwcCallback{rwc: conn, cb: reset}
+		_, err := io.Copy(w, io.TeeReader(rwc, h))
+		if err != nil {
+			return "", err
+		}
+		return fmt.Sprintf("%x", h.Sum64()), nil
+	})
+}
+
+func recv(port chan<- string, fn func(conn net.Conn, reset func()) (string, error)) (string, error) {
+	fail := make(chan error, 1)
+	checksum := make(chan string, 1)
 	reset, timeout := resetableTimeout(ioTimeout)
 	go func() {
-		h := xxhash.New()
-		var li net.Listener
-		var err error
-		err = Retry(func() error {
-			li, err = net.Listen("tcp", ":0")
-			return err
-		})
+		li, err := net.Listen("tcp", ":0")
 		if err != nil {
 			fail <- err
 			return
 		}
-		port <- Last(strings.Split(li.Addr().String(), ":"))
+		port <- strconv.Itoa(li.Addr().(*net.TCPAddr).Port)
 		conn, err := li.Accept()
 		if err != nil {
+			_ = li.Close()
 			fail <- err
 			return
 		}
-		rwc := rwcCallback{rwc: conn, cb: reset}
-		t := io.TeeReader(rwc, h)
-		_, err = io.Copy(w, t)
+		err = li.Close()
 		if err != nil {
+			_ = conn.Close()
 			fail <- err
 			return
 		}
-		err = rwc.Close()
+		chk, err := fn(conn, reset)
 		if err != nil {
+			_ = conn.Close()
 			fail <- err
 			return
 		}
-		err = li.Close()
+		err = conn.Close()
 		if err != nil {
 			fail <- err
 			return
 		}
-		checksum <- fmt.Sprintf("%x", h.Sum64())
+		checksum <- chk
 	}()
 	select {
 	case chk := <-checksum:
@@ -529,16 +753,55 @@ func SendFile(path string, addr string, port string) (string, error) {
 	if err != nil {
 		return "", err
 	}
-	bf := bufio.NewReaderSize(f, bufSize)
-	checksum, err := Send(bf, addr, port)
+	defer func() { _ = f.Close() }()
+	info, err := f.Stat()
 	if err != nil {
 		return "", err
 	}
-	err = f.Close()
-	if err != nil {
+	if !info.Mode().IsRegular() {
+		return Send(bufio.NewReaderSize(f, bufSize), addr, port)
+	}
+	reset, timeout := resetableTimeout(ioTimeout)
+	fail := make(chan error, 1)
+	checksum := make(chan string, 1)
+	go func() {
+		conn, err := dial(addr, port)
+		if err != nil {
+			fail <- err
+			return
+		}
+		chk, err := copyHashed(conn, f, f, reset)
+		if err != nil {
+			_ = conn.Close()
+			fail <- err
+			return
+		}
+		err = conn.Close()
+		if err != nil {
+			fail <- err
+			return
+		}
+		checksum <- chk
+	}()
+	select {
+	case chk := <-checksum:
+		return chk, nil
+	case err := <-fail:
 		return "", err
+	case <-timeout:
+		return "", fmt.Errorf("Send timeout")
 	}
-	return checksum, nil
+}
+
+func dial(addr string, port string) (net.Conn, error) {
+	dst := net.JoinHostPort(addr, port)
+	var conn net.Conn
+	err := Retry(func() error {
+		var err error
+		conn, err = net.DialTimeout("tcp", dst, ioTimeout)
+		return err
+	})
+	return conn, err
 }
 
 func Send(r io.Reader, addr string, port string) (string, error) {
@@ -547,13 +810,7 @@ func Send(r io.Reader, addr string, port string) (string, error) {
 	checksum := make(chan string)
 	go func() {
 		h := xxhash.New()
-		dst := fmt.Sprintf("%s:%s", addr, port)
-		var conn net.Conn
-		err := Retry(func() error {
-			var err error
-			conn, err = net.Dial("tcp", dst)
-			return err
-		})
+		conn, err := dial(addr, port)
 		if err != nil {
 			fail <- err
 			return
@@ -617,13 +874,20 @@ func (h *RootHandler) ServeHTTP(w http.ResponseWriter, r *http.Request) {
 			w.WriteHeader(500)
 			panic2(fmt.Fprintf(w, "%s\n", err))
 			seconds := fmt.Sprintf("%.5f", time.Since(start).Seconds())
-			Logger.Println(500, r.Method, r.URL.Path+"?"+r.URL.RawQuery, strings.Split(r.RemoteAddr, ":")[0], seconds)
+			Logger.Println(500, r.Method, r.URL.Path+"?"+r.URL.RawQuery, RemoteHost(r), seconds)
 		}
 	}()
 	wo := &responseObserver{w, 200}
 	h.Handler(wo, r, h.This, h.Servers)
 	seconds := fmt.Sprintf("%.5f", time.Since(start).Seconds())
-	Logger.Println(wo.Status, r.Method, r.URL.Path+"?"+r.URL.RawQuery, strings.Split(r.RemoteAddr, ":")[0], seconds)
+	Logger.Println(wo.Status, r.Method, r.URL.Path+"?"+r.URL.RawQuery, RemoteHost(r), seconds)
+}
+
+func RemoteHost(r *http.Request) string {
+	if i := strings.Index(r.RemoteAddr, ":"); i != -1 {
+		return r.RemoteAddr[:i]
+	}
+	return r.RemoteAddr
 }
 
 func Dir(pth string) string {
@@ -648,16 +912,12 @@ func Join(parts ...string) string {
 }
 
 func Exists(path string) (bool, error) {
-	_, err := os.Stat(path)
-	if err != nil {
+	info, err := os.Stat(path)
+	if err != nil || !info.Mode().IsRegular() {
 		return false, nil
 	}
-	checksumPath, err := ChecksumPath(path)
-	if err != nil {
-		return false, err
-	}
-	_, err = os.Stat(checksumPath)
-	return err == nil, nil
+	info, err = os.Stat(path + ".xxh")
+	return err == nil && info.Mode().IsRegular(), nil
 }
 
 func Contains(parts []string, part string) bool {
@@ -1,8 +1,13 @@
 package lib
 
 import (
+	"bytes"
 	"fmt"
+	"io/ioutil"
+	"net/http/httptest"
+	"os"
 	"testing"
+	"time"
 )
 
 func TestParseGlob(t *testing.T) {
@@ -69,3 +74,235 @@ func TestPickServer(t *testing.T) {
 		}
 	}
 }
+
+func TestPickServers(t *testing.T) {
+	servers := []Server{
+		{"a", "123"},
+		{"b", "123"},
+		{"c", "123"},
+	}
+	keys := []string{
+		"s4://bucket/a.txt",
+		"s4://bucket/d.txt",
+		"s4://bucket/f.txt",
+		"s4://bucket/dir/a.txt",
+		"s4://bucket/001_a.txt",
+		"s4://bucket/002",
+	}
+	picked, err := PickServers(keys, servers)
+	if err != nil {
+		t.Fatal(err)
+	}
+	for i, key := range keys {
+		want, _ := PickServer(key, servers)
+		if picked[i] != want {
+			t.Errorf("got: %s, want: %s", picked[i], want)
+		}
+	}
+	_, err = PickServers([]string{"s4://bucket/a.txt", "s4://bucket/dir/"}, servers)
+	if err == nil {
+		t.Errorf("expected error for directory key")
+	}
+}
+
+func TestMapArgs(t *testing.T) {
+	want := MapArgs{
+		Cmd:    `awk '{print $1 " & " $2}' | grep -v "a=b;c"`,
+		Indir:  "s4://bucket/in/*_1",
+		Outdir: "s4://bucket/out/",
+	}
+	r := httptest.NewRequest("POST", "/map", bytes.NewBuffer(want.Encode()))
+	r.Header.Set("Content-Type", "application/x-www-form-urlencoded")
+	got := ParseMapArgs(r)
+	if got != want {
+		t.Errorf("got: %v, want: %v", got, want)
+	}
+}
+
+func TestKeyPrefix(t *testing.T) {
+	type test struct {
+		key    string
+		prefix string
+		suffix string
+	}
+	tests := []test{
+		{"s4://bucket/dir/name.txt", "name.txt", ""},
+		{"s4://bucket/dir/000_bucket0.txt", "000", "bucket0.txt"},
+		{"s4://bucket/dir/000", "000", ""},
+		{"s4://bucket/dir/000_a_b", "000", "a_b"},
+		{"s4://bucket/dir/abc_000", "abc_000", ""},
+		{"000_x", "000", "x"},
+	}
+	for _, test := range tests {
+		prefix := KeyPrefix(test.key)
+		if prefix != test.prefix {
+			t.Errorf("got: %s, want: %s", prefix, test.prefix)
+		}
+		suffix, _ := keySuffix(test.key)
+		if suffix != test.suffix {
+			t.Errorf("got: %s, want: %s", suffix, test.suffix)
+		}
+	}
+}
+
+func TestExists(t *testing.T) {
+	dir := t.TempDir()
+	file := Join(dir, "file")
+	sub := Join(dir, "sub")
+	err := ioutil.WriteFile(file, []byte("data"), 0o644)
+	if err != nil {
+		t.Fatal(err)
+	}
+	err = os.Mkdir(sub, os.ModePerm)
+	if err != nil {
+		t.Fatal(err)
+	}
+	err = ioutil.WriteFile(sub+".xxh", []byte("0"), 0o644)
+	if err != nil {
+		t.Fatal(err)
+	}
+	for _, path := range []string{file, sub, Join(dir, "missing")} {
+		exists, err := Exists(path)
+		if err != nil || exists {
+			t.Errorf("got: %v %v, want: false <nil> for %s", exists, err, path)
+		}
+	}
+	err = ChecksumWrite(file, "0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	exists, err := Exists(file)
+	if err != nil || !exists {
+		t.Errorf("got: %v %v, want: true <nil>", exists, err)
+	}
+}
+
+func TestCopyHashed(t *testing.T) {
+	data := bytes.Repeat([]byte("0123456789"), sendfileChunk*3/10+1)
+	path := Join(t.TempDir(), "file")
+	err := ioutil.WriteFile(path, data, 0o644)
+	if err != nil {
+		t.Fatal(err)
+	}
+	f, err := os.Open(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer func() { _ = f.Close() }()
+	var dst bytes.Buffer
+	resets := 0
+	checksum, err := copyHashed(&dst, f, f, func() { resets++ })
+	if err != nil {
+		t.Fatal(err)
+	}
+	if !bytes.Equal(dst.Bytes(), data) {
+		t.Errorf("copied data does not match")
+	}
+	if want := xxh(bytes.NewReader(data)); checksum != want {
+		t.Errorf("got: %s, want: %s", checksum, want)
+	}
+	if resets != 4 {
+		t.Errorf("got: %d resets, want: 4", resets)
+	}
+}
+
+func TestChecksumDisk(t *testing.T) {
+	dir := t.TempDir()
+	data := bytes.Repeat([]byte("0123456789"), bufSize/5)
+	path := Join(dir, "file")
+	err := ioutil.WriteFile(path, data, 0o644)
+	if err != nil {
+		t.Fatal(err)
+	}
+	checksum, err := ChecksumDisk(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if want := xxh(bytes.NewReader(data)); checksum != want {
+		t.Errorf("got: %s, want: %s", checksum, want)
+	}
+	for _, path := range []string{Join(dir, "missing"), dir} {
+		checksum, err := ChecksumDisk(path)
+		if err == nil || checksum != "" {
+			t.Errorf("got: %q %v, want: error for %s", checksum, err, path)
+		}
+	}
+}
+
+func TestSendFilePipe(t *testing.T) {
+	data := bytes.Repeat([]byte("0123456789"), sendfileChunk/5)
+	r, w, err := os.Pipe()
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer func() { _ = r.Close() }()
+	go func() {
+		_, _ = w.Write(data)
+		_ = w.Close()
+	}()
+	port := make(chan string, 1)
+	received := make(chan string, 1)
+	var dst bytes.Buffer
+	go func() {
+		checksum, err := Recv(&dst, port)
+		if err != nil {
+			t.Error(err)
+		}
+		received <- checksum
+	}()
+	checksum, err := SendFile(fmt.Sprintf("/dev/fd/%d", r.Fd()), "127.0.0.1", <-port)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if got := <-received; got != checksum {
+		t.Errorf("got: %s, want: %s", got, checksum)
+	}
+	if want := xxh(bytes.NewReader(data)); checksum != want {
+		t.Errorf("got: %s, want: %s", checksum, want)
+	}
+	if !bytes.Equal(dst.Bytes(), data) {
+		t.Errorf("received data does not match")
+	}
+}
+
+func TestCache(t *testing.T) {
+	c := NewCache(2, 0)
+	c.Set("a", 1)
+	c.Set("b", 2)
+	val, _, ok := c.Get("a")
+	if !ok || val.(int) != 1 {
+		t.Errorf("got: %v %v, want: 1 true", val, ok)
+	}
+	c.Set("c", 3)
+	if len(c.items) != 1 {
+		t.Errorf("got: %d items, want: 1 after reset", len(c.items))
+	}
+	_, gen, _ := c.Get("d")
+	c.Delete("c")
+	c.Fill(gen, "d", 4)
+	if _, _, ok := c.Get("d"); ok {
+		t.Errorf("fill after a write should be dropped")
+	}
+	_, gen, _ = c.Get("d")
+	c.Fill(gen, "d", 4)
+	if _, _, ok := c.Get("d"); !ok {
+		t.Errorf("fill without a write should be stored")
+	}
+	c.Set("e", 5)
+	c.DeleteFunc(func(key string) bool { return key == "d" })
+	_, _, okD := c.Get("d")
+	_, _, okE := c.Get("e")
+	if okD || !okE {
+		t.Errorf("got: %v %v, want: false true", okD, okE)
+	}
+	c.Clear()
+	if _, _, ok := c.Get("e"); ok {
+		t.Errorf("clear should remove everything")
+	}
+	c = NewCache(2, time.Millisecond)
+	c.Set("a", 1)
+	time.Sleep(2 * time.Millisecond)
+	if _, _, ok := c.Get("a"); ok || len(c.items) != 0 {
+		t.Errorf("expired entry should be removed")
+	}
+}
@@ -11,19 +11,70 @@ import (
 	"path/filepath"
 	"sort"
 	"strings"
+	"time"
 
 	"github.com/nathants/s4/lib"
 )
 
+var listCache = lib.NewCache(1<<10, 2*time.Second)
+
+func cachedList(key string, list func() ([][]string, error)) ([][]string, error) {
+	val, gen, ok := listCache.Get(key)
+	if ok {
+		return copyLines(val.([][]string)), nil
+	}
+	lines, err := list()
+	if err != nil {
+		return [][]string{}, err
+	}
+	listCache.Fill(gen, key, lines)
+	return copyLines(lines), nil
+}
+
+func copyLines(lines [][]string) [][]string {
+	res := make([][]string, len(lines))
+	for i, line := range lines {
+		res[i] = append([]string(nil), line...)
+	}
+	return res
+}
+
+func invalidateListCache(prefix string) {
+	listCache.DeleteFunc(func(key string) bool {
+		cached := strings.SplitN(key, " ", 2)[0]
+		return strings.HasPrefix(prefix, cached) || strings.HasPrefix(cached, prefix)
+	})
+}
+
 func List(prefix string, recursive bool, servers []lib.Server) ([][]string, error) {
 	recursiveParam := ""
 	if recursive {
 		recursiveParam = "&recursive=true"
 	}
-	results := make(chan *lib.HTTPResult)
+	pathAndQuery := fmt.Sprintf("/list?prefix=%s%s", prefix, recursiveParam)
+	return cachedList(fmt.Sprint(prefix, " ", recursive, " ", servers), func() ([][]string, error) {
+		lines, err := getAll(pathAndQuery, servers)
+		if err != nil {
+			return [][]string{}, err
+		}
+		seen := make(map[string]bool, len(lines))
+		deduped := make([][]string, 0, len(lines))
+		for _, val := range lines {
+			if !seen[val[3]] {
+				seen[val[3]] = true
+				deduped = append(deduped, val)
+			}
+		}
+		sort.Slice(deduped, func(i, j int) bool { return deduped[i][3] < deduped[j][3] })
+		return deduped, nil
+	})
+}
+
+func getAll(pathAndQuery string, servers []lib.Server) ([][]string, error) {
+	results := make(chan *lib.HTTPResult, len(servers))
 	for _, server := range servers {
 		go func(server lib.Server) {
-			results <- lib.Get(fmt.Sprintf("http://%s:%s/list?prefix=%s%s", server.Address, server.Port, prefix, recursiveParam))
+			results <- lib.Get(fmt.Sprintf("http://%s:%s%s", server.Address, server.Port, pathAndQuery))
 		}(server)
 	}
 	var lines [][]string
@@ -42,14 +93,7 @@ func List(prefix string, recursive bool, servers []lib.Server) ([][]string, erro
 		}
 		lines = append(lines, tmp...)
 	}
-	sort.Slice(lines, func(i, j int) bool { return lines[i][3] < lines[j][3] })
-	var deduped [][]string
-	for _, val := range lines {
-		if len(deduped) == 0 || deduped[len(deduped)-1][3] != val[3] {
-			deduped = append(deduped, val)
-		}
-	}
-	return deduped, nil
+	return lines, nil
 }
 
 type httpRequest struct {
@@ -68,7 +112,7 @@ func postAll(requests []httpRequest, progress func()) error {
 	results := make(chan *httpResult, len(requests))
 	for _, request := range requests {
 		go func(request httpRequest) {
-			result := lib.Post(request.url, "application/json", bytes.NewBuffer(request.Data))
+			result := lib.Post(request.url, "application/x-www-form-urlencoded", bytes.NewBuffer(request.Data))
 			results <- &httpResult{result.StatusCode, result.Body, result.Err, request.url}
 		}(request)
 	}
@@ -86,53 +130,45 @@ func postAll(requests []httpRequest, progress func()) error {
 }
 
 func Map(indir string, outdir string, cmd string, servers []lib.Server, progress func()) error {
+	defer invalidateListCache(outdir)
 	var requests []httpRequest
 	for _, server := range servers {
 		url := fmt.Sprintf("http://%s:%s/map", server.Address, server.Port)
 		d := lib.MapArgs{Cmd: cmd, Indir: indir, Outdir: outdir}
-		bytes, err := json.Marshal(d)
-		if err != nil {
-			return err
-		}
-		requests = append(requests, httpRequest{url, bytes})
+		requests = append(requests, httpRequest{url, d.Encode()})
 	}
 	return postAll(requests, progress)
 }
 
 func MapToN(indir string, outdir string, cmd string, servers []lib.Server, progress func()) error {
+	defer invalidateListCache(outdir)
 	var requests []httpRequest
 	for _, server := range servers {
 		url := fmt.Sprintf("http://%s:%s/map_to_n", server.Address, server.Port)
 		d := lib.MapArgs{Cmd: cmd, Indir: indir, Outdir: outdir}
-		bytes, err := json.Marshal(d)
-		if err != nil {
-			return err
-		}
-		requests = append(requests, httpRequest{url, bytes})
+		requests = append(requests, httpRequest{url, d.Encode()})
 	}
 	return postAll(requests, progress)
 }
 
 func MapFromN(indir string, outdir string, cmd string, servers []lib.Server, progress func()) error {
+	defer invalidateListCache(outdir)
 	var requests []httpRequest
 	for _, server := range servers {
 		url := fmt.Sprintf("http://%s:%s/map_from_n", server.Address, server.Port)
 		d := lib.MapArgs{Cmd: cmd, Indir: indir, Outdir: outdir}
-		bytes, err := json.Marshal(d)
-		if err != nil {
-			return err
-		}
-		requests = append(requests, httpRequest{url, bytes})
+		requests = append(requests, httpRequest{url, d.Encode()})
 	}
 	return postAll(requests, progress)
 }
 
 func Rm(prefix string, recursive bool, servers []lib.Server) error {
+	defer invalidateListCache(prefix)
 	if !strings.HasPrefix(prefix, "s4://") {
 		return fmt.Errorf("missing s4:// prefix: %s", prefix)
 	}
 	if recursive {
-		results := make(chan *lib.HTTPResult)
+		results := make(chan *lib.HTTPResult, len(servers))
 		for _, server := range servers {
 			go func(server lib.Server) {
 				results <- lib.Post(fmt.Sprintf("http://%s:%s/delete?prefix=%s&recursive=true", server.Address, server.Port, prefix), "application/text", bytes.NewBuffer([]byte{}))
@@ -147,18 +183,18 @@ func Rm(prefix string, recursive bool, servers []lib.Server) error {
 				return fmt.Errorf("%d %s", result.StatusCode, result.Body)
 			}
 		}
-	} else {
-		server, err := lib.PickServer(prefix, servers)
-		if err != nil {
-			return err
-		}
-		result := lib.Post(fmt.Sprintf("http://%s:%s/delete?prefix=%s", server.Address, server.Port, prefix), "application/text", bytes.NewBuffer([]byte{}))
-		if result.Err != nil {
-			return result.Err
-		}
-		if result.StatusCode != 200 {
-			return fmt.Errorf("%d %s", result.StatusCode, result.Body)
-		}
+		return nil
+	}
+	server, err := lib.PickServer(prefix, servers)
+	if err != nil {
+		return err
+	}
+	result := lib.Post(fmt.Sprintf("http://%s:%s/delete?prefix=%s", server.Address, server.Port, prefix), "application/text", bytes.NewBuffer([]byte{}))
+	if result.Err != nil {
+		return result.Err
+	}
+	if result.StatusCode != 200 {
+		return fmt.Errorf("%d %s", result.StatusCode, result.Body)
 	}
 	return nil
 }
@@ -184,47 +220,29 @@ func Eval(key string, cmd string, servers []lib.Server) (string, error) {
 }
 
 func ListBuckets(servers []lib.Server) ([][]string, error) {
-	results := make(chan *lib.HTTPResult)
-	for _, server := range servers {
-		go func(server lib.Server) {
-			results <- lib.Get(fmt.Sprintf("http://%s:%s/list_buckets", server.Address, server.Port))
-		}(server)
-	}
-	buckets := make(map[string][]string)
-	for range servers {
-		result := <-results
-		if result.Err != nil {
-			return [][]string{}, result.Err
-		}
-		if result.StatusCode != 200 {
-			return [][]string{}, fmt.Errorf("%d %s", result.StatusCode, result.Body)
-		}
-		var res [][]string
-		err := json.Unmarshal(result.Body, &res)
+	return cachedList(fmt.Sprint("s4:// buckets ", servers), func() ([][]string, error) {
+		res, err := getAll("/list_buckets", servers)
 		if err != nil {
 			return [][]string{}, err
 		}
+		buckets := make(map[string][]string)
 		for _, line := range res {
 			path := line[3]
 			buckets[path] = line
 		}
-	}
-	var lines [][]string
-	var keys []string
-	for k := range buckets {
-		keys = append(keys, k)
-	}
-	sort.Slice(keys, func(i, j int) bool {
-		return keys[i] > keys[j]
+		lines := make([][]string, 0, len(buckets))
+		for _, line := range buckets {
+			lines = append(lines, line)
+		}
+		sort.Slice(lines, func(i, j int) bool {
+			return lines[i][3] > lines[j][3]
+		})
+		return lines, nil
 	})
-	for _, key := range keys {
-		lines = append(lines, buckets[key])
-	}
-	return lines, nil
 }
 
 func getRecursive(src string, dst string, servers []lib.Server) error {
-	part := strings.SplitN(src, "s4://", 2)[1]
+	part := strings.TrimPrefix(src, "s4://")
 	part = strings.TrimRight(part, "/")
 	parts := strings.Split(part, "/")
 	bucket := parts[0]
@@ -237,6 +255,7 @@ func getRecursive(src string, dst string, servers []lib.Server) error {
 	if err != nil {
 		return err
 	}
+	dirs := make(map[string]bool)
 	for _, line := range lines {
 		key := line[3]
 		token := prefix
@@ -249,11 +268,13 @@ func getRecursive(src string, dst string, servers []lib.Server) error {
 		pth := lib.Last(strings.SplitN(key, token, 2))
 		pth = strings.TrimLeft(pth, " /")
 		pth = lib.Join(dst, pth)
-		if lib.Dir(pth) != "" {
-			err := os.MkdirAll(lib.Dir(pth), os.ModePerm)
+		dir := lib.Dir(pth)
+		if dir != "" && !dirs[dir] {
+			err := os.MkdirAll(dir, os.ModePerm)
 			if err != nil {
 				return err
 			}
+			dirs[dir] = true
 		}
 		err := Cp(fmt.Sprintf("s4://%s", lib.Join(bucket, key)), pth, false, servers)
 		if err != nil {
@@ -367,37 +388,29 @@ func GetWriter(src string, dst io.Writer, servers []lib.Server) error {
 
 var Err409 = errors.New("409")
 
-func PutFile(src string, dst string, servers []lib.Server) error {
-	if strings.HasSuffix(dst, "/") {
-		dst = lib.Join(dst, path.Base(src))
-	}
-	server, err := lib.PickServer(dst, servers)
-	if err != nil {
-		return err
-	}
+func preparePut(server lib.Server, dst string) (string, string, error) {
 	url := fmt.Sprintf("http://%s:%s/prepare_put?key=%s", server.Address, server.Port, dst)
 	result := lib.Post(url, "application/text", bytes.NewBuffer([]byte{}))
 	if result.Err != nil {
-		return result.Err
+		return "", "", result.Err
 	}
 	if result.StatusCode == 409 {
-		return fmt.Errorf("key already exists: %s %w", dst, Err409)
+		return "", "", fmt.Errorf("key already exists: %s %w", dst, Err409)
 	}
 	if result.StatusCode != 200 {
-		return fmt.Errorf("%d %s", result.StatusCode, result.Body)
+		return "", "", fmt.Errorf("%d %s", result.StatusCode, result.Body)
 	}
-	vals := strings.Split(string(result.Body), " ")
-	if len(vals) != 2 {
-		return fmt.Errorf("bad put response: %s", result.Body)
-	}
-	uid := vals[0]
-	port := vals[1]
-	clientChecksum, err := lib.SendFile(src, server.Address, port)
-	if err != nil {
-		return err
+	body := string(result.Body)
+	i := strings.IndexByte(body, ' ')
+	if i == -1 || strings.IndexByte(body[i+1:], ' ') != -1 {
+		return "", "", fmt.Errorf("bad put response: %s", result.Body)
 	}
-	url = fmt.Sprintf("http://%s:%s/confirm_put?uuid=%s&checksum=%s", server.Address, server.Port, uid, clientChecksum)
-	result = lib.Post(url, "application/text", bytes.NewBuffer([]byte{}))
+	return body[:i], body[i+1:], nil
+}
+
+func confirmPut(server lib.Server, uid string, checksum string) error {
+	url := fmt.Sprintf("http://%s:%s/confirm_put?uuid=%s&checksum=%s", server.Address, server.Port, uid, checksum)
+	result := lib.Post(url, "application/text", bytes.NewBuffer([]byte{}))
 	if result.Err != nil {
 		return result.Err
 	}
@@ -407,41 +420,41 @@ func PutFile(src string, dst string, servers []lib.Server) error {
 	return nil
 }
 
-func PutReader(src io.Reader, dst string, servers []lib.Server) error {
+func PutFile(src string, dst string, servers []lib.Server) error {
+	if strings.HasSuffix(dst, "/") {
+		dst = lib.Join(dst, path.Base(src))
+	}
+	defer invalidateListCache(dst)
 	server, err := lib.PickServer(dst, servers)
 	if err != nil {
 		return err
 	}
-	url := fmt.Sprintf("http://%s:%s/prepare_put?key=%s", server.Address, server.Port, dst)
-	result := lib.Post(url, "application/text", bytes.NewBuffer([]byte{}))
-	if result.Err != nil {
-		return result.Err
+	uid, port, err := preparePut(server, dst)
+	if err != nil {
+		return err
 	}
-	if result.StatusCode == 409 {
-		return fmt.Errorf("key already exists: %s %w", dst, Err409)
+	clientChecksum, err := lib.SendFile(src, server.Address, port)
+	if err != nil {
+		return err
 	}
-	if result.StatusCode != 200 {
-		return fmt.Errorf("%d %s", result.StatusCode, result.Body)
+	return confirmPut(server, uid, clientChecksum)
+}
+
+func PutReader(src io.Reader, dst string, servers []lib.Server) error {
+	defer invalidateListCache(dst)
+	server, err := lib.PickServer(dst, servers)
+	if err != nil {
+		return err
 	}
-	vals := strings.Split(string(result.Body), " ")
-	if len(vals) != 2 {
-		return fmt.Errorf("bad put response: %s", result.Body)
+	uid, port, err := preparePut(server, dst)
+	if err != nil {
+		return err
 	}
-	uid := vals[0]
-	port := vals[1]
 	clientChecksum, err := lib.Send(src, server.Address, port)
 	if err != nil {
 		return err
 	}
-	url = fmt.Sprintf("http://%s:%s/confirm_put?uuid=%s&checksum=%s", server.Address, server.Port, uid, clientChecksum)
-	result = lib.Post(url, "application/text", bytes.NewBuffer([]byte{}))
-	if result.Err != nil {
-		return result.Err
-	}
-	if result.StatusCode != 200 {
-		return fmt.Errorf("%d %s", result.StatusCode, result.Body)
-	}
-	return nil
+	return confirmPut(server, uid, clientChecksum)
 }
 
 func Cp(src string, dst string, recursive bool, servers []lib.Server) error {
@@ -451,10 +464,10 @@ func Cp(src string, dst string, recursive bool, servers []lib.Server) error {
 	if strings.Contains(src, " ") || strings.Contains(dst, " ") {
 		return fmt.Errorf("spaces in keys are not allowed")
 	}
-	if strings.HasPrefix(src, "s4://") && strings.HasPrefix(strings.SplitN(src, "s4://", 2)[1], "_") {
+	if strings.HasPrefix(src, "s4://") && strings.HasPrefix(strings.TrimPrefix(src, "s4://"), "_") {
 		return fmt.Errorf("buckets cannot start with underscore")
 	}
-	if strings.HasPrefix(dst, "s4://") && strings.HasPrefix(strings.SplitN(dst, "s4://", 2)[1], "_") {
+	if strings.HasPrefix(dst, "s4://") && strings.HasPrefix(strings.TrimPrefix(dst, "s4://"), "_") {
 		return fmt.Errorf("buckets cannot start with underscore")
 	}
 	if recursive {
@@ -0,0 +1,92 @@
+package s4
+
+import (
+	"fmt"
+	"testing"
+	"time"
+
+	"github.com/nathants/s4/lib"
+)
+
+func TestCachedListCopies(t *testing.T) {
+	listCache = lib.NewCache(1<<10, time.Minute)
+	calls := 0
+	list := func() ([][]string, error) {
+		calls++
+		return [][]string{{"a", "b"}}, nil
+	}
+	lines, err := cachedList("s4://bucket/ false", list)
+	if err != nil {
+		t.Fatal(err)
+	}
+	lines[0][0] = "mutated"
+	lines, err = cachedList("s4://bucket/ false", list)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if calls != 1 {
+		t.Errorf("got: %d calls, want: 1", calls)
+	}
+	if lines[0][0] != "a" {
+		t.Errorf("got: %s, want: a", lines[0][0])
+	}
+}
+
+func TestCachedListExpires(t *testing.T) {
+	listCache = lib.NewCache(1<<10, time.Millisecond)
+	calls := 0
+	list := func() ([][]string, error) {
+		calls++
+		return [][]string{}, nil
+	}
+	_, _ = cachedList("s4://bucket/ false", list)
+	time.Sleep(2 * time.Millisecond)
+	_, _ = cachedList("s4://bucket/ false", list)
+	if calls != 2 {
+		t.Errorf("got: %d calls, want: 2", calls)
+	}
+}
+
+func TestCachedListBounded(t *testing.T) {
+	listCache = lib.NewCache(4, time.Minute)
+	calls := 0
+	list := func() ([][]string, error) {
+		calls++
+		return [][]string{}, nil
+	}
+	for i := 0; i < 5; i++ {
+		_, _ = cachedList(fmt.Sprintf("s4://bucket/%d/ false", i), list)
+	}
+	_, _ = cachedList("s4://bucket/4/ false", list)
+	_, _ = cachedList("s4://bucket/0/ false", list)
+	if calls != 6 {
+		t.Errorf("got: %d calls, want: 6", calls)
+	}
+}
+
+func TestInvalidateListCache(t *testing.T) {
+	listCache = lib.NewCache(1<<10, time.Minute)
+	calls := map[string]int{}
+	keys := []string{"s4:// buckets", "s4://bucket/ true", "s4://bucket/dir/ false", "s4://bucket/other/ true", "s4://other/ true"}
+	for _, key := range keys {
+		key := key
+		_, _ = cachedList(key, func() ([][]string, error) {
+			calls[key]++
+			return [][]string{}, nil
+		})
+	}
+	invalidateListCache("s4://bucket/dir/key.txt")
+	for _, key := range keys {
+		key := key
+		_, _ = cachedList(key, func() ([][]string, error) {
+			calls[key]++
+			return [][]string{}, nil
+		})
+	}
+	want := map[string]int{"s4:// buckets": 2, "s4://bucket/ true": 2, "s4://bucket/dir/ false": 2, "s4://bucket/other/ true": 1, "s4://other/ true": 1}
+	for key, n := range want {
+		if calls[key] != n {
+			t.Errorf("got: %d calls, want: %d for %s", calls[key], n, key)
+		}
+	}
+}
@@ -153,6 +153,14 @@ def test_basic():
         assert run('cat foo/file.txt') == "123"
         assert run("s4 ls | awk '{print $NF}'").splitlines() == ['bucket']
 
+def test_verify_disk():
+    with servers(extra_conf='-verify-disk'):
+        run('echo 123 | s4 cp - s4://bucket/verify/file.txt')
+        run('echo 345 > file2.txt')
+        run('s4 cp file2.txt s4://bucket/verify/')
+        assert '123' == run('s4 cp s4://bucket/verify/file.txt -')
+        assert '345' == run('s4 cp s4://bucket/verify/file2.txt -')
+
 def test_cp_file_to_dot():
     with servers():
         run('echo foo > file.txt')
@@ -311,6 +319,21 @@ def test_ls():
             bucket
         """)
 
+def test_ls_after_put_is_not_stale():
+    with servers():
+        run('echo | s4 cp - s4://bucket/ls/key1.txt')
+        assert run("s4 ls -r s4://bucket/ | awk '{print $NF}'").splitlines() == ['ls/key1.txt']
+        run('echo | s4 cp - s4://bucket/ls/key2.txt')
+        assert run("s4 ls -r s4://bucket/ | awk '{print $NF}'").splitlines() == ['ls/key1.txt', 'ls/key2.txt']
+
+def test_ls_after_rm_is_not_stale():
+    with servers():
+        run('echo | s4 cp - s4://bucket/ls/key1.txt')
+        run('echo | s4 cp - s4://bucket/ls/key2.txt')
+        assert run("s4 ls -r s4://bucket/ | awk '{print $NF}'").splitlines() == ['ls/key1.txt', 'ls/key2.txt']
+        run('s4 rm s4://bucket/ls/key1.txt')
+        assert run("s4 ls -r s4://bucket/ | awk '{print $NF}'").splitlines() == ['ls/key2.txt']
+
 def test_rm():
     with servers():
         run('echo | s4 cp - s4://bucket/rm/dir1/key1.txt')
@@ -327,6 +350,17 @@ def test_rm():
         with pytest.raises(Exception):
             run('s4 ls -r s4://bucket/rm/')
 
+def test_rm_then_put_returns_new_data():
+    with servers():
+        run('echo 123 | s4 cp - s4://bucket/rm/key.txt')
+        assert '123' == run('s4 cp s4://bucket/rm/key.txt -')
+        run('s4 rm s4://bucket/rm/key.txt')
+        run('echo 345 | s4 cp - s4://bucket/rm/key.txt')
+        assert '345' == run('s4 cp s4://bucket/rm/key.txt -')
+        run('s4 rm -r s4://bucket/rm/')
+        run('echo 678 | s4 cp - s4://bucket/rm/key.txt')
+        assert '678' == run('s4 cp s4://bucket/rm/key.txt -')
+
 def test_stdin():
     with servers():
         run('echo foo | s4 cp - s4://bucket/stdin/bar')